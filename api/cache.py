@@ -0,0 +1,107 @@
+"""In-process result caches and request coalescing for the API."""
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class ByteLRU:
+    """LRU mapping bounded by the summed size (bytes) of its values.
+
+    Sizes are supplied by the caller on `put`; an item larger than the whole
+    budget is simply not stored.  Hit / miss / eviction counters are kept for
+    /stats/cache.
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, size) = self._items.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"entries": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+class SingleFlight:
+    """Coalesce concurrent identical async calls into one execution.
+
+    The first caller for a key starts `factory()` as a task; callers arriving
+    while it runs await the same task and get the same result (or exception).
+    A caller that is cancelled (client went away) only stops waiting; the task
+    itself is cancelled once no caller is left, so an abandoned query still
+    gets its job cancelled.  Results are not kept after completion — that is
+    the caches' job.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, list] = {}     # key -> [task, waiters]
+        self.executions = self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(factory())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda t: self._calls.pop(key, None)
+                                   if self._calls.get(key) is call else None)
+            self.executions += 1
+        else:
+            self.shared += 1
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                if self._calls.get(key) is call:     # later callers start afresh
+                    del self._calls[key]
+                call[0].cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.executions + self.shared
+        return {"in_flight": len(self._calls), "executions": self.executions,
+                "shared": self.shared, "share_rate": round(self.shared / total, 4) if total else 0.0}
@@ -2,43 +2,61 @@
 
 Serves three views over the Gaia data:
   * stars    — sampled 3D point cloud (cheap, cluster-pruned, projected to a year)
-  * density  — precomputed healpix x distance-shell voxels (table density_voxels)
-  * hr       — precomputed BP-RP x absolute-mag histogram (table hr_bins)
+  * density  — precomputed healpix x distance-shell voxels at several levels of
+                detail (tables density_voxels, density_pyramid)
+  * hr       — precomputed BP-RP x absolute-mag histograms per healpix x distance
+                shell, summed over any sector / range (table hr_bins)
   * clusters — open clusters / moving groups (tables cluster_catalog, cluster_stars)
 
-If the BigQuery client or a precomputed table is unavailable, each function
-falls back to synthetic mock data so the frontend still renders (and local dev
-works without GCP).  Run bq_jobs/build.py + clustering.py to populate the tables.
+Set GAIA_LOCAL_DIR to the `gaia_ly` Parquet tree to serve the same views from
+local disk instead of BigQuery (see local.py).  If neither the local tree, the
+BigQuery client nor a precomputed table is available, each function falls back
+to synthetic mock data so the frontend still renders (and local dev works
+without GCP).  Run bq_jobs/build.py + clustering.py to populate the tables.
 """
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import os
-import tempfile
-from typing import Any, Dict, List, Optional
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 from dotenv import load_dotenv
 from google.cloud import bigquery
 from google.api_core.exceptions import GoogleAPIError, NotFound
+from sampling import SAMPLE_TIERS
+
+from . import healpix, local, metrics, spatial
+from .cache import ByteLRU, SingleFlight
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- BigQuery client (service-account JSON, ADC, or none -> mock) ----------- #
-try:
-    if os.getenv("GOOGLE_CREDENTIALS_JSON"):
-        creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
-        json.loads(creds_json)
-        with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".json") as tmp:
-            tmp.write(creds_json)
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = tmp.name
-    client = bigquery.Client()
-except Exception as exc:  # noqa: BLE001
-    logger.error(f"BigQuery client unavailable, using mock data: {exc}")
-    client = None
+# Built on first use (warm_up() does it at startup), not at import: finding
+# credentials can take seconds (ADC probes the metadata server), and every
+# worker would pay that before it could accept a request.
+# GOOGLE_CREDENTIALS_JSON is parsed in memory; nothing is written to disk.
+_client: Optional[bigquery.Client] = None
+_client_ready = False
+_client_lock = threading.Lock()
+_credentials = None     # service-account credentials, shared with the Storage client
+
+# Large results stream over the Storage Read API (Arrow record batches over
+# gRPC) when google-cloud-bigquery-storage is installed; small ones still come
+# back over REST.  BQ_STORAGE_API=0 turns it off.
+USE_STORAGE_API = os.getenv("BQ_STORAGE_API", "1").lower() not in ("0", "false", "no")
+_bqstorage = None
+_bqstorage_lock = threading.Lock()
 
 # --- Table configuration ---------------------------------------------------- #
 PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT", "aicouncelling")
@@ -47,13 +65,54 @@ EXTERNAL_TABLE = os.getenv("BIGQUERY_TABLE", f"{PROJECT}.{DATASET}.stars")
 # Prefer the native clustered table for interactive queries; override via env.
 STARS_TABLE = os.getenv("STARS_TABLE", f"{PROJECT}.{DATASET}.stars_native")
 DENSITY_TABLE = f"{PROJECT}.{DATASET}.density_voxels"
+DENSITY_PYRAMID_TABLE = f"{PROJECT}.{DATASET}.density_pyramid"
 HR_TABLE = f"{PROJECT}.{DATASET}.hr_bins"
 CLUSTER_STARS_TABLE = f"{PROJECT}.{DATASET}.cluster_stars"
 CLUSTER_CATALOG_TABLE = f"{PROJECT}.{DATASET}.cluster_catalog"
 
+# --- Query execution --------------------------------------------------------- #
+# Warehouse jobs and local Parquet reads block, so they run on a bounded thread
+# pool; at most MAX_CONCURRENT_QUERIES are in flight per worker, the rest wait
+# (cancellably) on the semaphore.
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "8"))
+QUERY_TIMEOUT_S = float(os.getenv("QUERY_TIMEOUT_S", "60"))
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES, thread_name_prefix="query")
+_slots = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+
+# Per-query scan budget, checked with a (free) dry run before a job is
+# submitted; estimates are cached per SQL shape for DRY_RUN_TTL_S.  External
+# tables dry-run as 0 bytes, so a query on EXTERNAL_TABLE is charged its full
+# size.  Dry runs can't see clustering pruning either, so queries on the
+# clustered tables pass the share of rows they select (from the density
+# voxels) and are charged that share of the dry run.  SCAN_BUDGET_GB=0
+# disables the check.
+SCAN_BUDGET_BYTES = int(float(os.getenv("SCAN_BUDGET_GB", "5")) * 1e9)
+EXTERNAL_TABLE_BYTES = int(float(os.getenv("EXTERNAL_TABLE_GB", "77")) * 1e9)
+DRY_RUN_TTL_S = float(os.getenv("DRY_RUN_TTL_S", "3600"))
+_scan_estimates: Dict[str, Tuple[int, float]] = {}
+
+# Unprojected /stars results per normalised (min_dist, max_dist, healpix, limit);
+# the `year` projection is applied on the way out, so time-slider moves hit it.
+STAR_CACHE_BYTES = int(float(os.getenv("STAR_CACHE_MB", "256")) * 2**20)
+star_cache = ByteLRU("stars", STAR_CACHE_BYTES)
+# Spatial indexes over those samples, for /neighbors and /within.
+SPATIAL_CACHE_BYTES = int(float(os.getenv("SPATIAL_CACHE_MB", "64")) * 2**20)
+spatial_cache = ByteLRU("spatial", SPATIAL_CACHE_BYTES)
+# Concurrent identical requests (a class opening the app at once) share one
+# execution: per star query, per aggregate reload and per SQL statement.
+inflight = SingleFlight("queries")
+
+# Hash-sampling tiers written by bq_jobs/build.py (materialize) and
+# pyspark_code/ly_partitioning.py (see sampling.py); read ~TIER_HEADROOM x
+# the rows needed.
+TIER_HEADROOM = 1.15
+
 MAS_TO_RAD_YR = (np.pi / 180.0) / 3_600_000.0
 FORCE_MOCK = os.getenv("MOCK_DATA", "").lower() in ("1", "true", "yes")
-_rng = np.random.default_rng(42)
+# Mocks are seeded per parameter set and memoized; the star pool is drawn once
+# and sliced, so MOCK_MAX_STARS can go to millions for load tests.
+MOCK_SEED = 42
+MOCK_MAX_STARS = int(os.getenv("MOCK_MAX_STARS", "20000"))
 
 
 def _healpix_range(healpix: Optional[int]):
@@ -64,19 +123,336 @@ def _healpix_range(healpix: Optional[int]):
     return p0 * 16, (p0 + 1) * 16 - 1
 
 
-def _run(sql: str, params: list) -> list:
+class QueryTimeout(Exception):
+    """A query ran longer than QUERY_TIMEOUT_S (the job has been cancelled)."""
+
+
+class OverBudget(Exception):
+    """A query's dry-run estimate exceeds SCAN_BUDGET_BYTES; it was not run."""
+
+
+async def _offload(fn, *args, on_cancel=None, stage: Optional[str] = None):
+    """Run blocking `fn(*args)` on the query pool without stalling the event loop.
+
+    On timeout or cancellation (e.g. the client went away) `on_cancel` is
+    called so the underlying job can be stopped; the worker thread itself
+    can't be interrupted and finishes on its own.  Time waiting for a pool
+    slot is recorded as the "queue" stage, and the call itself as `stage`.
+    """
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    async with _slots:
+        metrics.STAGES.observe(time.perf_counter() - t0, stage="queue")
+        if stage:
+            fn = _timed(stage, fn)
+        fut = loop.run_in_executor(_executor, fn, *args)
+        try:
+            return await asyncio.wait_for(fut, QUERY_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            if on_cancel:
+                on_cancel()
+            raise QueryTimeout(f"query exceeded {QUERY_TIMEOUT_S:g}s") from None
+        except asyncio.CancelledError:
+            if on_cancel:
+                on_cancel()
+            raise
+
+
+def _timed(stage: str, fn):
+    def call(*args):
+        with metrics.stage(stage):
+            return fn(*args)
+    return call
+
+
+def _cancel_jobs(jobs: list) -> None:
+    def cancel():
+        for job in jobs:
+            try:
+                job.cancel()
+            except GoogleAPIError as exc:
+                logger.warning(f"couldn't cancel job {job.job_id}: {exc}")
+    # job.cancel() is an API round-trip; keep it off the loop and the query pool.
+    asyncio.get_running_loop().run_in_executor(None, cancel)
+
+
+def _sql_shape(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+async def _scan_estimate(sql: str, params: list) -> int:
+    """Bytes `sql` would scan, from a cached dry run of the same statement shape.
+
+    Parameters don't enter the key: clustered-table pruning isn't reflected in
+    dry runs, so the estimate is the same upper bound for every value.
+    """
+    shape = _sql_shape(sql)
+    hit = _scan_estimates.get(shape)
+    if hit is not None and time.monotonic() - hit[1] < DRY_RUN_TTL_S:
+        return hit[0]
+
+    def dry_run():
+        cfg = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False,
+                                      query_parameters=params)
+        return get_client().query(sql, job_config=cfg).total_bytes_processed or 0
+    nbytes = await inflight.run(("dry_run", shape), lambda: _offload(dry_run))
+    if nbytes == 0 and _external(sql):
+        nbytes = EXTERNAL_TABLE_BYTES
+    _scan_estimates[shape] = (nbytes, time.monotonic())
+    return nbytes
+
+
+def _external(sql: str) -> bool:
+    return EXTERNAL_TABLE != STARS_TABLE and f"`{EXTERNAL_TABLE}`" in sql
+
+
+async def _query(sql: str, params: list, fetch, scan_fraction: float = 1.0):
+    if SCAN_BUDGET_BYTES:
+        est = await _scan_estimate(sql, params)
+        if not _external(sql):          # nothing to prune in an external table
+            est = int(est * scan_fraction)
+        if est > SCAN_BUDGET_BYTES:
+            metrics.BQ_JOBS.inc(status="over_budget")
+            raise OverBudget(f"would scan {est / 1e9:.1f} GB "
+                             f"(budget {SCAN_BUDGET_BYTES / 1e9:g} GB)")
     cfg = bigquery.QueryJobConfig(query_parameters=params)
-    return list(client.query(sql, job_config=cfg).result())
+    jobs: list = []
+    stop = threading.Event()
+
+    def work():
+        with metrics.stage("warehouse"):
+            job = get_client().query(sql, job_config=cfg)
+            jobs.append(job)
+            if stop.is_set():       # cancelled while the job was being submitted
+                job.cancel()
+            try:
+                result = job.result()
+            except GoogleAPIError:
+                metrics.BQ_JOBS.inc(status="cancelled" if stop.is_set() else "error")
+                raise
+        metrics.record_job(job)
+        with metrics.stage("fetch"):
+            return fetch(result)
+
+    def cancel():
+        stop.set()
+        _cancel_jobs(jobs)
+    return await _offload(work, on_cancel=cancel)
+
+
+def _make_client() -> bigquery.Client:
+    global _credentials
+    info = os.getenv("GOOGLE_CREDENTIALS_JSON")
+    if not info:
+        return bigquery.Client()
+    from google.oauth2 import service_account
+    _credentials = service_account.Credentials.from_service_account_info(json.loads(info))
+    # GOOGLE_CLOUD_PROJECT (the billing project ADC would use) wins over the key's own.
+    project = os.getenv("GOOGLE_CLOUD_PROJECT") or _credentials.project_id
+    return bigquery.Client(project=project, credentials=_credentials)
+
+
+def get_client() -> Optional[bigquery.Client]:
+    """Shared BigQuery client, created on the first call; None if unavailable.
+
+    Blocking (credential discovery): call it from the query pool, or await
+    _bq() on the event loop.
+    """
+    global _client, _client_ready
+    if not _client_ready:
+        with _client_lock:
+            if not _client_ready:
+                t0 = time.perf_counter()
+                try:
+                    _client = _make_client()
+                except Exception as exc:  # noqa: BLE001
+                    logger.error(f"BigQuery client unavailable, using mock data: {exc}")
+                dt = time.perf_counter() - t0
+                metrics.STARTUP.set(dt, phase="bigquery_client")
+                logger.info(f"BigQuery client setup took {dt * 1000:.0f} ms")
+                _client_ready = True
+    return _client
+
+
+async def _bq() -> Optional[bigquery.Client]:
+    return _client if _client_ready else await _offload(get_client)
+
+
+def _storage_client():
+    """Shared BigQueryReadClient, or None (not installed / disabled / failed)."""
+    global _bqstorage, USE_STORAGE_API
+    if _bqstorage is None and USE_STORAGE_API:
+        with _bqstorage_lock:
+            if _bqstorage is None and USE_STORAGE_API:
+                try:    # optional, and slow to import: only when first needed
+                    from google.cloud import bigquery_storage
+                    _bqstorage = bigquery_storage.BigQueryReadClient(credentials=_credentials)
+                except ImportError:
+                    USE_STORAGE_API = False
+                except Exception as exc:  # noqa: BLE001
+                    logger.warning(f"Storage Read API unavailable ({exc}); using REST.")
+                    USE_STORAGE_API = False
+    return _bqstorage
+
+
+def _params_key(params: list) -> tuple:
+    return tuple((p.name, p.array_type, tuple(p.values)) if hasattr(p, "values")
+                 else (p.name, p.type_, p.value) for p in params)
+
+
+async def _run_columns(sql: str, params: list,
+                       scan_fraction: float = 1.0) -> Dict[str, np.ndarray]:
+    """Run `sql` and return its result as one NumPy array per column.
+
+    Rows never become Python objects: the result is fetched as Arrow (over the
+    Storage Read API when available) and each column converted once, so the
+    response builders get arrays directly.  Identical statements already
+    running are joined rather than resubmitted.  `scan_fraction` is the share
+    of the table clustering lets it read (see _scan_fraction).
+    """
+    def fetch(result):
+        table = result.to_arrow(bqstorage_client=_storage_client(),
+                                create_bqstorage_client=False)
+        metrics.ROWS.inc(table.num_rows, source="bigquery")
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    return await inflight.run(("sql", sql, _params_key(params)),
+                              lambda: _query(sql, params, fetch, scan_fraction))
 
 
 # --------------------------------------------------------------------------- #
 # Stars — sampled 3D scatter, projected to `year`
 # --------------------------------------------------------------------------- #
+@dataclass
+class StarBatch:
+    """`stars` rows as columns, unprojected: J2016 position (ly) + velocity (ly/yr)."""
+    source_id: np.ndarray   # int64
+    pos: np.ndarray         # (N, 3) float64, ly
+    vel: np.ndarray         # (N, 3) float64, ly / yr
+    mag: np.ndarray         # Gaia G
+    dist: np.ndarray        # ly
+
+    def __len__(self) -> int:
+        return len(self.dist)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.source_id, self.pos, self.vel, self.mag, self.dist))
+
+    @classmethod
+    def from_columns(cls, cols: Dict[str, np.ndarray]) -> "StarBatch":
+        """Raw `stars` columns (unit vector, proper-motion vector, distance)."""
+        with metrics.stage("convert"):
+            d = np.asarray(cols["distance_ly"], dtype=float)
+            unit = np.column_stack([cols["x"], cols["y"], cols["z"]]).astype(float)
+            pm = np.column_stack([cols["vx"], cols["vy"], cols["vz"]]).astype(float)
+            return cls(np.asarray(cols["source_id"], dtype=np.int64), unit * d[:, None],
+                       pm * (MAS_TO_RAD_YR * d)[:, None],
+                       np.asarray(cols["phot_g_mean_mag"], dtype=float), d)
+
+    def take(self, idx) -> "StarBatch":
+        """Rows `idx` (index array or slice) as a new batch."""
+        return StarBatch(self.source_id[idx], self.pos[idx], self.vel[idx],
+                         self.mag[idx], self.dist[idx])
+
+    def positions(self, year: float) -> np.ndarray:
+        """(N, 3) positions in ly, linearly projected from J2016 to `year`."""
+        dt = year - 2016.0
+        return self.pos + self.vel * dt if dt else self.pos
+
+    def ephemeris(self) -> List[Dict[str, Any]]:
+        """Response dicts with J2016 position and velocity, for clients that
+        project to other years themselves."""
+        with metrics.stage("convert"):
+            p, v = self.pos, self.vel
+            return [{"source_id": str(s), "x": x, "y": y, "z": z, "vx": a, "vy": b, "vz": c,
+                     "mag": m, "dist": d}
+                    for s, x, y, z, a, b, c, m, d in zip(
+                        self.source_id.tolist(), p[:, 0].tolist(), p[:, 1].tolist(),
+                        p[:, 2].tolist(), v[:, 0].tolist(), v[:, 1].tolist(),
+                        v[:, 2].tolist(), self.mag.tolist(), self.dist.tolist())]
+
+    def records(self, year: float) -> List[Dict[str, Any]]:
+        """Response dicts.  The projection runs as whole-array NumPy ops; the only
+        per-star Python work left is zipping the `.tolist()` columns into dicts."""
+        with metrics.stage("convert"):
+            p = self.positions(year)
+            return [{"source_id": str(s), "x": x, "y": y, "z": z, "mag": m, "dist": d}
+                    for s, x, y, z, m, d in zip(self.source_id.tolist(), p[:, 0].tolist(),
+                                                p[:, 1].tolist(), p[:, 2].tolist(),
+                                                self.mag.tolist(), self.dist.tolist())]
+
+
 async def query_stars(min_dist: float, max_dist: float, healpix: Optional[int] = None,
                       limit: int = 25000, year: int = 2016) -> List[Dict[str, Any]]:
-    if client is None or FORCE_MOCK:
-        return _mock_stars(min_dist, max_dist, limit, year)
-    dt = year - 2016.0
+    batch = await query_star_batch(min_dist, max_dist, healpix, limit)
+    return batch.records(year)
+
+
+def brightest_first(batch: StarBatch, chunk: int = 5000) -> Iterator[StarBatch]:
+    """`batch` re-ordered brightest first, in chunks of `chunk` stars (for streaming)."""
+    order = np.argsort(batch.mag, kind="stable")
+    for i in range(0, len(order), chunk):
+        yield batch.take(order[i:i + chunk])
+
+
+def _star_key(min_dist: float, max_dist: float, healpix: Optional[int], limit: int) -> tuple:
+    return round(float(min_dist), 3), round(float(max_dist), 3), healpix, int(limit)
+
+
+async def query_star_batch(min_dist: float, max_dist: float, healpix: Optional[int] = None,
+                           limit: int = 25000) -> StarBatch:
+    """Unprojected star sample, served from star_cache when the same query was seen."""
+    key = _star_key(min_dist, max_dist, healpix, limit)
+    batch = star_cache.get(key)
+    if batch is None:
+        try:
+            batch = await inflight.run(
+                ("stars", key), lambda: _fetch_star_batch(min_dist, max_dist, healpix, limit))
+        except OverBudget:      # degrade to the density voxels, but don't cache them
+            return await _voxel_batch(min_dist, max_dist, healpix, limit)
+        if batch is None:       # every source failed: serve mock, but don't cache it
+            return _mock_batch(min_dist, max_dist, limit)
+        star_cache.put(key, batch, batch.nbytes)
+    return batch
+
+
+async def _sample_tiers(min_dist: float, max_dist: float, healpix: Optional[int],
+                        limit: int) -> int:
+    """How many of the SAMPLE_TIERS hash tiers to read so `limit` rows come back.
+
+    Each star's `sample_tier` is a hash of its source_id, so `sample_tier < k`
+    is a uniform k / SAMPLE_TIERS sample.  The expected row count comes from the
+    cached density voxels (partial shells weighted by overlap).
+    """
+    agg = await aggregate("density")
+    if agg.version.startswith("mock"):
+        return SAMPLE_TIERS
+    c = agg.data.levels[0]
+    b = c["distance_bin"].astype(float)
+    overlap = np.clip((np.minimum(b + 50, max_dist) - np.maximum(b, min_dist)) / 50.0, 0.0, 1.0)
+    hp = _healpix_range(healpix)
+    if hp:
+        overlap = np.where((c["healpix"] >= hp[0]) & (c["healpix"] <= hp[1]), overlap, 0.0)
+    expected = float((c["n"] * overlap).sum())
+    if expected <= 0:
+        return SAMPLE_TIERS
+    return int(min(SAMPLE_TIERS, np.ceil(SAMPLE_TIERS * limit * TIER_HEADROOM / expected)))
+
+
+async def _fetch_star_batch(min_dist: float, max_dist: float, healpix: Optional[int],
+                            limit: int) -> Optional[StarBatch]:
+    if FORCE_MOCK or (not local.enabled() and await _bq() is None):
+        return _mock_batch(min_dist, max_dist, limit)
+    tiers = await _sample_tiers(min_dist, max_dist, healpix, limit)
+    if local.enabled():
+        try:
+            cols = await _offload(local.stars, min_dist, max_dist, _healpix_range(healpix),
+                                  limit, tiers, stage="local_read")
+            metrics.ROWS.inc(len(cols["distance_ly"]), source="local")
+            return StarBatch.from_columns(cols)
+        except local.ERRORS as exc:
+            logger.warning(f"local stars query failed ({exc}); mock fallback.")
+            return None
     where = "distance_ly BETWEEN @min_dist AND @max_dist AND phot_g_mean_mag IS NOT NULL"
     params = [bigquery.ScalarQueryParameter("min_dist", "FLOAT64", min_dist),
               bigquery.ScalarQueryParameter("max_dist", "FLOAT64", max_dist)]
@@ -86,160 +462,764 @@ async def query_stars(min_dist: float, max_dist: float, healpix: Optional[int] =
         params += [bigquery.ScalarQueryParameter("min_hp", "INT64", hp[0]),
                    bigquery.ScalarQueryParameter("max_hp", "INT64", hp[1])]
     params.append(bigquery.ScalarQueryParameter("lim", "INT64", limit))
-    # No ORDER BY RAND(): rely on cluster pruning (healpix_2, distance_bin) + LIMIT.
-    # Prefer the native clustered table; fall back to the external one if it
-    # hasn't been materialised yet, then to mock data.
-    rows = None
-    candidates = [STARS_TABLE] + ([EXTERNAL_TABLE] if EXTERNAL_TABLE != STARS_TABLE else [])
-    for tbl in candidates:
+    # No ORDER BY RAND(): `sample_tier < @tiers` keeps a uniform hash sample of
+    # about `limit` rows.  ORDER BY sample_tier (cheap on those ~TIER_HEADROOM x
+    # limit rows) makes LIMIT drop the highest tiers everywhere, rather than
+    # whichever clustered blocks come last.  Tables
+    # materialised before sample_tier existed (and the external table) fall
+    # back to plain LIMIT, then to mock data.
+    tiered = (where + " AND sample_tier < @tiers ORDER BY sample_tier",
+              params + [bigquery.ScalarQueryParameter("tiers", "INT64", tiers)])
+    frac = await _scan_fraction(min_dist, max_dist,
+                                np.arange(hp[0], hp[1] + 1) if hp else None)
+    # Both are charged the full clustered share: a (healpix_2, distance_bin)
+    # cell is far smaller than a storage block, so every block spans nearly all
+    # tiers and the sample_tier filter prunes nothing.
+    candidates = [(STARS_TABLE, tiered, frac)] if tiers < SAMPLE_TIERS else []
+    candidates += [(STARS_TABLE, (where, params), frac)]
+    if EXTERNAL_TABLE != STARS_TABLE:
+        candidates.append((EXTERNAL_TABLE, (where, params), 1.0))
+    # A source whose estimate is over the scan budget is skipped; if that leaves
+    # nothing, OverBudget tells query_star_batch to degrade to the density
+    # voxels rather than mock data.
+    over_budget = False
+    for tbl, (cond, args), share in candidates:
         sql = f"""
             SELECT source_id, x, y, z, vx, vy, vz, phot_g_mean_mag, distance_ly
             FROM `{tbl}`
-            WHERE {where}
+            WHERE {cond}
             LIMIT @lim
         """
         try:
-            rows = _run(sql, params)
-            break
+            return StarBatch.from_columns(await _run_columns(sql, args, share))
+        except OverBudget as exc:
+            logger.warning(f"stars query on {tbl} skipped: {exc}.")
+            over_budget = True
         except (NotFound, GoogleAPIError) as exc:
             logger.warning(f"stars query on {tbl} failed ({exc}); trying next source.")
-    if rows is None:
-        return _mock_stars(min_dist, max_dist, limit, year)
-
-    out = []
-    for r in rows:
-        d = r.distance_ly
-        vlx, vly, vlz = (r.vx * MAS_TO_RAD_YR * d, r.vy * MAS_TO_RAD_YR * d,
-                         r.vz * MAS_TO_RAD_YR * d)
-        out.append({"source_id": str(r.source_id),
-                    "x": r.x * d + vlx * dt, "y": r.y * d + vly * dt, "z": r.z * d + vlz * dt,
-                    "mag": r.phot_g_mean_mag, "dist": d})
-    return out
+    if over_budget:
+        raise OverBudget("every stars source is over the scan budget")
+    return None
 
 
-# --------------------------------------------------------------------------- #
-# Density — precomputed voxels
-# --------------------------------------------------------------------------- #
-async def query_density(min_dist: float, max_dist: float,
-                        healpix: Optional[int] = None) -> List[Dict[str, Any]]:
-    if client is None or FORCE_MOCK:
-        return _mock_density(min_dist, max_dist)
-    where = "distance_bin BETWEEN @min_d AND @max_d AND n > 0"
-    params = [bigquery.ScalarQueryParameter("min_d", "INT64", int(min_dist)),
-              bigquery.ScalarQueryParameter("max_d", "INT64", int(max_dist))]
+async def _scan_fraction(min_dist: float, max_dist: float,
+                         healpix_2: Optional[np.ndarray] = None) -> float:
+    """Share of the stars table a query clustered on (healpix_2, distance_bin)
+    reads, from the density voxels' star counts.  1.0 (the dry run's bound)
+    while those are mock."""
+    agg = await aggregate("density")
+    if agg.version.startswith("mock"):
+        return 1.0
+    c = agg.data.levels[0]
+    b = c["distance_bin"]
+    m = (b + 50 > min_dist) & (b <= max_dist)
+    if healpix_2 is not None:
+        m &= np.isin(c["healpix"], healpix_2)
+    total = float(c["n"].sum())
+    return float(c["n"][m].sum()) / total if total else 1.0
+
+
+async def _voxel_batch(min_dist: float, max_dist: float, healpix: Optional[int],
+                       limit: int) -> StarBatch:
+    """Coarse stand-in for a star sample: one point per density voxel at its
+    centroid, brighter the more stars it holds."""
+    c = (await aggregate("density")).data.levels[0]
+    m = (c["distance_bin"] >= min_dist) & (c["distance_bin"] <= max_dist) & (c["n"] > 0)
     hp = _healpix_range(healpix)
     if hp:
-        where += " AND healpix_2 BETWEEN @min_hp AND @max_hp"
-        params += [bigquery.ScalarQueryParameter("min_hp", "INT64", hp[0]),
-                   bigquery.ScalarQueryParameter("max_hp", "INT64", hp[1])]
+        m &= (c["healpix"] >= hp[0]) & (c["healpix"] <= hp[1])
+    idx = np.flatnonzero(m)
+    idx = idx[np.argsort(-c["n"][idx], kind="stable")[:limit]]
+    pos = np.column_stack([c["cx"][idx], c["cy"][idx], c["cz"][idx]]).astype(float)
+    n = np.asarray(c["n"][idx], dtype=float)
+    return StarBatch(np.full(len(idx), -1, dtype=np.int64), pos, np.zeros_like(pos),
+                     15.0 - 2.5 * np.log10(n), np.linalg.norm(pos, axis=1))
+
+
+# --------------------------------------------------------------------------- #
+# Cone search — stars within a radius of (RA, Dec), via fine HEALPix pixels
+# --------------------------------------------------------------------------- #
+CONE_MAX_STARS = 50000
+
+
+async def query_cone(ra: float, dec: float, radius: float, mag_limit: float = 21.0,
+                     min_dist: float = 0, max_dist: float = 17000,
+                     limit: int = 5000) -> StarBatch:
+    """Stars within `radius` degrees of (ra, dec) and brighter than `mag_limit`,
+    brightest first (at most `limit`).  Cached like query_star_batch."""
+    key = ("cone", round(float(ra), 4), round(float(dec), 4), round(float(radius), 4),
+           round(float(mag_limit), 2)) + _star_key(min_dist, max_dist, None, limit)
+    batch = star_cache.get(key)
+    if batch is None:
+        disc = healpix.Disc.cover(ra, dec, radius)
+        batch = await inflight.run(key, lambda: _fetch_cone(disc, mag_limit, min_dist,
+                                                            max_dist, limit))
+        if batch is None:
+            return _mock_cone(disc, mag_limit, min_dist, max_dist, limit)
+        star_cache.put(key, batch, batch.nbytes)
+    return batch
+
+
+async def _fetch_cone(disc: healpix.Disc, mag_limit: float, min_dist: float,
+                      max_dist: float, limit: int) -> Optional[StarBatch]:
+    if FORCE_MOCK or (not local.enabled() and await _bq() is None):
+        return _mock_cone(disc, mag_limit, min_dist, max_dist, limit)
+    if local.enabled():
+        try:
+            cols = await _offload(local.cone, disc, min_dist, max_dist, mag_limit, limit,
+                                  stage="local_read")
+            metrics.ROWS.inc(len(cols["distance_ly"]), source="local")
+            return StarBatch.from_columns(cols)
+        except local.ERRORS as exc:
+            logger.warning(f"local cone query failed ({exc}); mock fallback.")
+            return None
+    # healpix_2 is the clustering key, so only the disc's partitions are read;
+    # the fine pixel (from source_id) and the dot product then cut to the cone.
+    params = [
+        bigquery.ArrayQueryParameter("hp2", "INT64", disc.healpix_2.tolist()),
+        bigquery.ArrayQueryParameter("pix", "INT64", disc.pixels.tolist()),
+        bigquery.ScalarQueryParameter("pix_div", "INT64", healpix.source_id_divisor(disc.order)),
+        bigquery.ScalarQueryParameter("cx", "FLOAT64", float(disc.center[0])),
+        bigquery.ScalarQueryParameter("cy", "FLOAT64", float(disc.center[1])),
+        bigquery.ScalarQueryParameter("cz", "FLOAT64", float(disc.center[2])),
+        bigquery.ScalarQueryParameter("cos_r", "FLOAT64", disc.cos_radius),
+        bigquery.ScalarQueryParameter("mag", "FLOAT64", mag_limit),
+        bigquery.ScalarQueryParameter("min_dist", "FLOAT64", min_dist),
+        bigquery.ScalarQueryParameter("max_dist", "FLOAT64", max_dist),
+        bigquery.ScalarQueryParameter("lim", "INT64", limit),
+    ]
+    frac = await _scan_fraction(min_dist, max_dist, disc.healpix_2)
+    tables = [STARS_TABLE] + ([EXTERNAL_TABLE] if EXTERNAL_TABLE != STARS_TABLE else [])
+    for tbl in tables:
+        sql = f"""
+            SELECT source_id, x, y, z, vx, vy, vz, phot_g_mean_mag, distance_ly
+            FROM `{tbl}`
+            WHERE healpix_2 IN UNNEST(@hp2)
+              AND DIV(source_id, @pix_div) IN UNNEST(@pix)
+              AND x * @cx + y * @cy + z * @cz >= @cos_r
+              AND phot_g_mean_mag <= @mag
+              AND distance_ly BETWEEN @min_dist AND @max_dist
+            ORDER BY phot_g_mean_mag
+            LIMIT @lim
+        """
+        try:
+            return StarBatch.from_columns(await _run_columns(sql, params, frac))
+        except OverBudget as exc:
+            logger.warning(f"cone query on {tbl} skipped: {exc}.")
+        except (NotFound, GoogleAPIError) as exc:
+            logger.warning(f"cone query on {tbl} failed ({exc}); trying next source.")
+    return None
+
+
+# --------------------------------------------------------------------------- #
+# Spatial queries — neighbours within a star sample, via an octree index
+# --------------------------------------------------------------------------- #
+SPATIAL_MAX_STARS = 10000
+
+
+async def star_index(min_dist: float, max_dist: float,
+                     limit: int) -> Tuple[StarBatch, spatial.OctreeIndex]:
+    """The star sample of a distance shell (as served by /stars) and an octree
+    index over its J2016 positions, built once per sample and shared."""
+    key = _star_key(min_dist, max_dist, None, limit)
+    batch = await query_star_batch(min_dist, max_dist, None, limit)
+    hit = spatial_cache.get(key)
+    # Fallback samples (density voxels, mock) aren't in star_cache and come back
+    # as new objects on every call: match them by content, not identity.
+    if hit is not None and (hit[0] is batch or np.array_equal(hit[0].pos, batch.pos)):
+        return hit
+
+    async def build() -> Tuple[StarBatch, spatial.OctreeIndex]:
+        grid = await _offload(spatial.OctreeIndex, batch.pos, stage="index")
+        spatial_cache.put(key, (batch, grid), grid.nbytes)
+        return batch, grid
+
+    return await inflight.run(("spatial", key), build)
+
+
+async def _center(batch: StarBatch, center, source_id: Optional[int]) -> np.ndarray:
+    """Query point in ly: `center`, or star `source_id` (from the sample if it
+    is in it, else looked up).  KeyError if that star doesn't exist."""
+    if source_id is None:
+        return np.asarray(center, dtype=float)
+    at = np.flatnonzero(batch.source_id == source_id)
+    if len(at):
+        return batch.pos[at[0]]
+    found, _ = await lookup_stars([source_id])
+    if not found:
+        raise KeyError(source_id)
+    return np.array([found[0]["x"], found[0]["y"], found[0]["z"]])
+
+
+async def query_neighbors(center, source_id: Optional[int], k: int, min_dist: float,
+                          max_dist: float, limit: int) -> Tuple[StarBatch, np.ndarray]:
+    """The k stars of the shell sample nearest `center` (or star `source_id`,
+    itself excluded), nearest first, with their distances (ly) from it."""
+    batch, grid = await star_index(min_dist, max_dist, limit)
+    p = await _center(batch, center, source_id)
+    idx, d = grid.nearest(p, k + (source_id is not None))
+    if source_id is not None:
+        keep = batch.source_id[idx] != source_id
+        idx, d = idx[keep][:k], d[keep][:k]
+    return batch.take(idx), d
+
+
+async def query_within(center, source_id: Optional[int], radius: float, min_dist: float,
+                       max_dist: float, limit: int,
+                       max_stars: int) -> Tuple[StarBatch, np.ndarray]:
+    """Stars of the shell sample within `radius` ly of `center` (or star
+    `source_id`), nearest first and at most `max_stars`, with their distances."""
+    batch, grid = await star_index(min_dist, max_dist, limit)
+    idx, d = grid.within(await _center(batch, center, source_id), radius)
+    return batch.take(idx[:max_stars]), d[:max_stars]
+
+
+# --------------------------------------------------------------------------- #
+# Lookup by source_id — routed to the healpix_2 partition in the id's top bits
+# --------------------------------------------------------------------------- #
+LOOKUP_MAX_IDS = 1000
+
+
+def _lookup_records(cols: Dict[str, np.ndarray]) -> Dict[int, Dict[str, Any]]:
+    d = np.asarray(cols["distance_ly"], dtype=float)
+    x, y, z = (np.asarray(cols[k], dtype=float) for k in ("x", "y", "z"))
+    ra = np.degrees(np.arctan2(y, x)) % 360.0
+    dec = np.degrees(np.arcsin(np.clip(z, -1.0, 1.0)))
+    bp = [None if v != v else v for v in np.asarray(cols["bp_rp"], dtype=float).tolist()]
+    return {s: {"source_id": str(s), "ra": r, "dec": de, "dist": dd,
+                "x": xx * dd, "y": yy * dd, "z": zz * dd, "mag": m, "bp_rp": b,
+                "has_rvs": bool(h), "healpix_2": hp}
+            for s, r, de, dd, xx, yy, zz, m, b, h, hp in zip(
+                np.asarray(cols["source_id"]).tolist(), ra.tolist(), dec.tolist(), d.tolist(),
+                x.tolist(), y.tolist(), z.tolist(),
+                np.asarray(cols["phot_g_mean_mag"], dtype=float).tolist(), bp,
+                np.asarray(cols["has_rvs"]).tolist(), np.asarray(cols["healpix_2"]).tolist())}
+
+
+async def lookup_stars(source_ids: List[int]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """(found stars in request order, ids not found).  J2016 positions in ly."""
+    ids = np.unique(np.asarray(source_ids, dtype=np.int64))
+    if FORCE_MOCK or (not local.enabled() and await _bq() is None):
+        cols = _mock_lookup(ids)
+    elif local.enabled():
+        try:
+            cols = await _offload(local.lookup, ids, stage="local_read")
+            metrics.ROWS.inc(len(cols["source_id"]), source="local")
+        except local.ERRORS as exc:
+            logger.warning(f"local lookup failed ({exc}); mock fallback.")
+            cols = _mock_lookup(ids)
+    else:
+        cols = await _lookup_bigquery(ids)
+    found = _lookup_records(cols)
+    return ([found[i] for i in source_ids if i in found],
+            [i for i in source_ids if i not in found])
+
+
+async def _lookup_bigquery(ids: np.ndarray) -> Dict[str, np.ndarray]:
+    # healpix_2 is derivable from the id and is the clustering key, so each id
+    # only touches its own partition's blocks.
+    hp2 = np.unique(healpix.healpix_2(ids))
+    params = [bigquery.ArrayQueryParameter("hp2", "INT64", hp2.tolist()),
+              bigquery.ArrayQueryParameter("ids", "INT64", ids.tolist())]
     sql = f"""
-        SELECT healpix_2, distance_bin, n, mean_bp_rp, cx, cy, cz
-        FROM `{DENSITY_TABLE}` WHERE {where}
+        SELECT {', '.join(local.LOOKUP_COLUMNS)}
+        FROM `{STARS_TABLE}`
+        WHERE healpix_2 IN UNNEST(@hp2) AND source_id IN UNNEST(@ids)
     """
     try:
-        rows = _run(sql, params)
-    except (NotFound, GoogleAPIError) as exc:
-        logger.warning(f"density query failed ({exc}); mock fallback.")
-        return _mock_density(min_dist, max_dist)
-    return [{"hp": r.healpix_2, "bin": r.distance_bin, "n": r.n,
-             "bp_rp": r.mean_bp_rp, "x": r.cx, "y": r.cy, "z": r.cz} for r in rows]
+        return await _run_columns(sql, params, await _scan_fraction(0, np.inf, hp2))
+    except (NotFound, GoogleAPIError, OverBudget) as exc:
+        logger.warning(f"source_id lookup failed ({exc}); mock fallback.")
+        return _mock_lookup(ids)
 
 
 # --------------------------------------------------------------------------- #
-# HR diagram — precomputed histogram
+# Precomputed aggregates — whole tables cached in process, keyed by version
 # --------------------------------------------------------------------------- #
-async def query_hr() -> List[Dict[str, Any]]:
-    if client is None or FORCE_MOCK:
-        return _mock_hr()
-    sql = f"SELECT bp_rp_bin, absmag_bin, n FROM `{HR_TABLE}`"
+# The aggregate tables only change when bq_jobs/ is rerun, so each is pulled
+# once and filtered in memory.  Its version (BigQuery last-modified time, or
+# the local Parquet mtime) is rechecked at most every AGG_VERSION_TTL_S, and
+# drives the ETags in main.py.  refresh_aggregates() forces a reload.
+AGG_VERSION_TTL_S = float(os.getenv("AGG_VERSION_TTL_S", "300"))
+MEMBER_PAGE_MAX = 50000
+_MOCK_VERSION = f"mock:{MOCK_SEED}"     # mocks are deterministic: same ETag in every worker
+
+
+@dataclass
+class Aggregate:
+    version: str
+    data: Any
+    checked: float
+
+
+_aggregates: Dict[str, Aggregate] = {}
+
+
+async def _table_version(table: str) -> str:
+    name = table.rsplit(".", 1)[-1]
     try:
-        rows = _run(sql, [])
-    except (NotFound, GoogleAPIError) as exc:
-        logger.warning(f"hr query failed ({exc}); mock fallback.")
-        return _mock_hr()
-    return [{"bp_rp": r.bp_rp_bin, "absmag": r.absmag_bin, "n": r.n} for r in rows]
+        if local.enabled():
+            return await _offload(local.version, name)
+        t = await _offload((await _bq()).get_table, table)
+    except (NotFound, FileNotFoundError):
+        if table not in _OPTIONAL_TABLES:
+            raise
+        return f"{name}@none"
+    return f"{name}@{t.modified.timestamp():.0f}"
+
+
+async def _load_density() -> "DensityPyramid":
+    cols = ["healpix_2", "distance_bin", "n", "mean_bp_rp", "cx", "cy", "cz"]
+    if local.enabled():
+        base = await _offload(local.table, "density_voxels", cols, stage="local_read")
+    else:
+        base = await _run_columns(
+            f"SELECT {', '.join(cols)} FROM `{DENSITY_TABLE}` WHERE n > 0", [])
+    # The coarser levels come from density_pyramid when it has been built,
+    # otherwise they are summed up here from the base voxels.
+    cols = ["lod", "healpix"] + cols[1:]
+    try:
+        if local.enabled():
+            pyr = await _offload(local.table, "density_pyramid", cols, stage="local_read")
+        else:
+            pyr = await _run_columns(
+                f"SELECT {', '.join(cols)} FROM `{DENSITY_PYRAMID_TABLE}` WHERE n > 0", [])
+    except (NotFound, GoogleAPIError, OverBudget, *local.ERRORS) as exc:
+        logger.info(f"density_pyramid unavailable ({exc}); coarsening in process.")
+        pyr = None
+    return DensityPyramid.build(base, pyr)
+
+
+async def _load_hr() -> "HRCube":
+    cols = ["healpix_2", "distance_bin", "bp_rp_bin", "absmag_bin", "n"]
+    if local.enabled():
+        c = await _offload(local.table, "hr_bins", cols, stage="local_read")
+    else:
+        c = await _run_columns(f"SELECT {', '.join(cols)} FROM `{HR_TABLE}`", [])
+    with metrics.stage("convert"):
+        return HRCube.build(c)
+
+
+async def _load_clusters() -> Tuple[List[Dict[str, Any]], "ClusterMembers"]:
+    mem_cols = ["source_id", "X", "Y", "Z", "mag", "cluster_id"]
+    if local.enabled():
+        cat = await _offload(local.table, "cluster_catalog", stage="local_read")
+        mem = await _offload(local.table, "cluster_stars", mem_cols, stage="local_read")
+    else:
+        cat = await _run_columns(f"SELECT * FROM `{CLUSTER_CATALOG_TABLE}`", [])
+        mem = await _run_columns(
+            f"SELECT {', '.join(mem_cols)} FROM `{CLUSTER_STARS_TABLE}`", [])
+    order = np.argsort(-np.asarray(cat["n"]), kind="stable")
+    return (_catalog_records({k: np.asarray(v)[order].tolist() for k, v in cat.items()}),
+            ClusterMembers.build(_member_columns(mem)))
+
+
+# name -> (source tables, loader, mock generator).  Every source table is in
+# the version, so rebuilding any one of them changes the ETag; an optional
+# table that doesn't exist (yet) versions as "<name>@none".
+_AGGREGATES = {
+    "density": ([DENSITY_TABLE, DENSITY_PYRAMID_TABLE], _load_density,
+                lambda: DensityPyramid.build(_mock_density())),
+    "hr": ([HR_TABLE], _load_hr, lambda: HRCube.build(_mock_hr())),
+    "clusters": ([CLUSTER_CATALOG_TABLE, CLUSTER_STARS_TABLE], _load_clusters,
+                 lambda: _mock_clusters()),
+}
+_OPTIONAL_TABLES = {DENSITY_PYRAMID_TABLE}     # coarsened in process when missing
+
+
+async def aggregate(name: str) -> Aggregate:
+    """Cached aggregate `name`, reloaded only when its source version changes."""
+    cur = _aggregates.get(name)
+    if cur is not None and time.monotonic() - cur.checked < AGG_VERSION_TTL_S:
+        return cur
+    return await inflight.run(("aggregate", name), lambda: _reload_aggregate(name, cur))
+
+
+async def _reload_aggregate(name: str, cur: Optional[Aggregate]) -> Aggregate:
+    now = time.monotonic()
+    tables, load, mock = _AGGREGATES[name]
+    try:
+        if FORCE_MOCK or (not local.enabled() and await _bq() is None):
+            version, data = _MOCK_VERSION, None
+        else:
+            version = "|".join([await _table_version(t) for t in tables])
+            data = None if cur is not None and cur.version == version else await load()
+    except (NotFound, GoogleAPIError, OverBudget, *local.ERRORS) as exc:
+        if cur is not None:     # transient (file being rewritten, network): keep serving it
+            logger.warning(f"{name} aggregate recheck failed ({exc}); keeping {cur.version}.")
+            cur.checked = now
+            return cur
+        logger.warning(f"{name} aggregate unavailable ({exc}); mock fallback.")
+        version, data = _MOCK_VERSION, None
+    if cur is not None and cur.version == version:
+        cur.checked = now
+        return cur
+    if data is None:
+        data = mock()
+    _aggregates[name] = cur = Aggregate(version, data, now)
+    return cur
+
+
+def refresh_aggregates() -> None:
+    """Recheck every cached aggregate on its next request (reloading it if its
+    source changed); the current data stays in use if the source can't be read."""
+    for agg in _aggregates.values():
+        agg.checked = float("-inf")
+
+
+async def aggregate_version(name: str) -> str:
+    return (await aggregate(name)).version
+
+
+async def warm_up() -> None:
+    """Get a new worker ready while it is already serving: the BigQuery client
+    (or the local row-group index, or the mock star pool) and every aggregate,
+    loaded concurrently.  Failures only log; requests retry on their own."""
+    t0 = time.perf_counter()
+    steps = [aggregate(name) for name in _AGGREGATES]
+    if FORCE_MOCK:
+        steps.append(_offload(_mock_pool))
+    elif local.enabled():
+        steps.append(_offload(local.index))
+    else:
+        steps.append(_bq())
+    for res in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(res, Exception):
+            logger.warning(f"warm-up step failed: {res!r}")
+    dt = time.perf_counter() - t0
+    metrics.STARTUP.set(dt, phase="warm_up")
+    logger.info(f"warm-up done in {dt * 1000:.0f} ms")
 
 
 # --------------------------------------------------------------------------- #
-# Clusters — catalogue + sampled members
+# Density — precomputed voxels
 # --------------------------------------------------------------------------- #
-async def query_clusters(max_members: int = 40000) -> Dict[str, Any]:
-    if client is None or FORCE_MOCK:
-        return _mock_clusters()
-    try:
-        cat = _run(f"SELECT * FROM `{CLUSTER_CATALOG_TABLE}` ORDER BY n DESC", [])
-        mem = _run(f"""SELECT X, Y, Z, mag, cluster_id FROM `{CLUSTER_STARS_TABLE}`
-                       LIMIT {int(max_members)}""", [])
-    except (NotFound, GoogleAPIError) as exc:
-        logger.warning(f"cluster query failed ({exc}); mock fallback.")
-        return _mock_clusters()
-    clusters = [{"id": c.cluster_id, "n": c.n, "name": c.name,
-                 "x": c.cx, "y": c.cy, "z": c.cz,
-                 "dist": c.dist_ly, "bp_rp": c.mean_bp_rp} for c in cat]
-    stars = [{"x": m.X, "y": m.Y, "z": m.Z, "mag": m.mag, "cid": m.cluster_id} for m in mem]
-    return {"clusters": clusters, "stars": stars}
+# Level of detail -> (healpix level, shell width in ly).  Level 0 is
+# density_voxels itself; coarser levels merge pixels (nested scheme: the
+# level-l parent of healpix_2 p is p >> 2 * (2 - l)) and distance shells.
+DENSITY_LODS = [(2, 50), (2, 100), (1, 500), (0, 1000)]
+# /density picks the finest level whose answer stays under this many voxels,
+# so the payload is about the same at every zoom.
+DENSITY_TARGET_VOXELS = int(os.getenv("DENSITY_TARGET_VOXELS", "6000"))
+_VOXEL_MEANS = ("mean_bp_rp", "cx", "cy", "cz")
+
+
+def _coarsen(c: Dict[str, np.ndarray], hp_level: int, shell: int) -> Dict[str, np.ndarray]:
+    """Merge level-0 voxels into (healpix level, shell) voxels; means are n-weighted."""
+    hp = np.asarray(c["healpix"], dtype=np.int64) >> (2 * (2 - hp_level))
+    b = np.asarray(c["distance_bin"], dtype=np.int64) // shell * shell
+    key, inv = np.unique((hp << 32) + b, return_inverse=True)
+    n = np.asarray(c["n"], dtype=float)
+    out = {"healpix": key >> 32, "distance_bin": key & 0xFFFFFFFF,
+           "n": np.bincount(inv, weights=n, minlength=len(key)).astype(np.int64)}
+    for k in _VOXEL_MEANS:
+        v = np.asarray(c[k], dtype=float)
+        ok = np.isfinite(v)
+        w = np.bincount(inv, weights=np.where(ok, n, 0.0), minlength=len(key))
+        s = np.bincount(inv, weights=np.where(ok, n * v, 0.0), minlength=len(key))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[k] = np.where(w > 0, s / w, np.nan)
+    return out
+
+
+@dataclass
+class DensityPyramid:
+    """density_voxels at every DENSITY_LODS level, as NumPy columns
+    (healpix, distance_bin, n, mean_bp_rp, cx, cy, cz)."""
+    levels: List[Dict[str, np.ndarray]]
+
+    @classmethod
+    def build(cls, base: Dict[str, np.ndarray],
+              pyramid: Optional[Dict[str, np.ndarray]] = None) -> "DensityPyramid":
+        """From the level-0 voxels plus, if given, a density_pyramid table
+        (levels it lacks are computed here)."""
+        c = {k: np.asarray(v) for k, v in base.items() if k != "healpix_2"}
+        levels = [dict(c, healpix=np.asarray(base["healpix_2"]))]
+        lods = np.asarray(pyramid["lod"]) if pyramid is not None else np.empty(0)
+        for lod, (hp_level, shell) in enumerate(DENSITY_LODS[1:], 1):
+            m = lods == lod
+            if m.any():
+                levels.append({k: np.asarray(v)[m] for k, v in pyramid.items() if k != "lod"})
+            else:
+                levels.append(_coarsen(levels[0], hp_level, shell))
+        return cls(levels)
+
+    def mask(self, lod: int, min_dist: float, max_dist: float,
+             healpix: Optional[int]) -> np.ndarray:
+        """Voxels of level `lod` whose shell overlaps [min_dist, max_dist]."""
+        c, (hp_level, shell) = self.levels[lod], DENSITY_LODS[lod]
+        b = c["distance_bin"]
+        m = (b + shell > min_dist) & (b <= max_dist) & (c["n"] > 0)
+        hp = _healpix_range(healpix)
+        if hp:
+            shift = 2 * (2 - hp_level)
+            m &= (c["healpix"] >= hp[0] >> shift) & (c["healpix"] <= hp[1] >> shift)
+        return m
+
+    def pick(self, min_dist: float, max_dist: float, healpix: Optional[int]) -> int:
+        """Finest level that answers the query in <= DENSITY_TARGET_VOXELS voxels."""
+        for lod in range(len(self.levels)):
+            if int(self.mask(lod, min_dist, max_dist, healpix).sum()) <= DENSITY_TARGET_VOXELS:
+                return lod
+        return len(self.levels) - 1
+
+
+async def query_density(min_dist: float, max_dist: float, healpix: Optional[int] = None,
+                        lod: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """(level of detail used, voxels).  `lod` None picks it from the range."""
+    pyr = (await aggregate("density")).data
+    if lod is None:
+        lod = pyr.pick(min_dist, max_dist, healpix)
+    c, m = pyr.levels[lod], pyr.mask(lod, min_dist, max_dist, healpix)
+    return lod, [{"hp": hp_, "bin": b, "n": n, "bp_rp": bp, "x": x, "y": y, "z": z}
+                 for hp_, b, n, bp, x, y, z in zip(*(c[k][m].tolist() for k in (
+                     "healpix", "distance_bin", "n", "mean_bp_rp", "cx", "cy", "cz")))]
+
+
+# --------------------------------------------------------------------------- #
+# HR diagram — precomputed colour-magnitude cube
+# --------------------------------------------------------------------------- #
+HR_SHELL_LY = 50
+# (bin width, index of the lowest bin, number of bins) per axis, matching the
+# ROUND()s and bounds of the hr job: bp_rp -0.6..4.5, absmag -6..20.
+HR_BP_RP = (0.05, -12, 103)
+HR_ABSMAG = (0.2, -30, 131)
+HR_CELLS = HR_BP_RP[2] * HR_ABSMAG[2]
+
+
+def _hr_index(values: np.ndarray, axis: Tuple[float, int, int]) -> np.ndarray:
+    step, first, size = axis
+    return np.clip(np.rint(np.asarray(values, dtype=float) / step) - first, 0, size - 1)
+
+
+@dataclass
+class HRCube:
+    """hr_bins as a sparse (healpix_2, distance shell) x colour-magnitude cube.
+
+    COO entries are sorted by voxel (healpix_2 * shells + shell), so a sector
+    and distance range is one contiguous slice per pixel: voxel v holds
+    entries offsets[v]:offsets[v + 1].  A cell is bp_rp index * HR_ABSMAG
+    bins + absmag index.  Filtered histograms are one bincount over the slices.
+    """
+    cell: np.ndarray        # uint16, per entry
+    n: np.ndarray           # uint32, per entry
+    offsets: np.ndarray     # int64, 192 * shells + 1
+    shells: int
+    total: np.ndarray       # whole-sky histogram per cell
+
+    @classmethod
+    def build(cls, c: Dict[str, np.ndarray]) -> "HRCube":
+        dbin = np.asarray(c["distance_bin"], dtype=np.int64) // HR_SHELL_LY
+        shells = int(dbin.max()) + 1 if len(dbin) else 1
+        voxel = np.asarray(c["healpix_2"], dtype=np.int64) * shells + dbin
+        cell = (_hr_index(c["bp_rp_bin"], HR_BP_RP) * HR_ABSMAG[2]
+                + _hr_index(c["absmag_bin"], HR_ABSMAG)).astype(np.uint16)
+        n = np.asarray(c["n"], dtype=np.uint32)
+        order = np.argsort(voxel, kind="stable")
+        offsets = np.searchsorted(voxel[order], np.arange(192 * shells + 1))
+        total = np.bincount(cell, weights=n, minlength=HR_CELLS).astype(np.int64)
+        return cls(cell[order], n[order], offsets, shells, total)
+
+    def histogram(self, min_dist: float, max_dist: float,
+                  healpix: Optional[int]) -> np.ndarray:
+        """Counts per cell over the shells overlapping [min_dist, max_dist]."""
+        lo = max(0, int(min_dist // HR_SHELL_LY))
+        hi = min(self.shells - 1, int(max_dist // HR_SHELL_LY))
+        if healpix is None and lo == 0 and hi == self.shells - 1:
+            return self.total
+        if hi < lo:
+            return np.zeros(HR_CELLS, dtype=np.int64)
+        hp = _healpix_range(healpix) or (0, 191)
+        pix = np.arange(hp[0], hp[1] + 1) * self.shells
+        spans = list(zip(self.offsets[pix + lo], self.offsets[pix + hi + 1]))
+        cell = np.concatenate([self.cell[a:b] for a, b in spans])
+        n = np.concatenate([self.n[a:b] for a, b in spans])
+        return np.bincount(cell, weights=n, minlength=HR_CELLS).astype(np.int64)
+
+
+async def query_hr(min_dist: float = 0, max_dist: float = 17000,
+                   healpix: Optional[int] = None) -> List[Dict[str, Any]]:
+    h = (await aggregate("hr")).data.histogram(min_dist, max_dist, healpix)
+    idx = np.flatnonzero(h)
+    bp = np.round((idx // HR_ABSMAG[2] + HR_BP_RP[1]) * HR_BP_RP[0], 2)
+    absmag = np.round((idx % HR_ABSMAG[2] + HR_ABSMAG[1]) * HR_ABSMAG[0], 2)
+    return [{"bp_rp": b, "absmag": a, "n": n} for b, a, n in
+            zip(bp.tolist(), absmag.tolist(), h[idx].tolist())]
+
+
+# --------------------------------------------------------------------------- #
+# Clusters — catalogue + per-cluster member pages
+# --------------------------------------------------------------------------- #
+@dataclass
+class ClusterMembers:
+    """All member stars sorted by (cid, source_id), plus each cluster's row range.
+
+    A page is a slice of one cluster's range: the cursor is the last
+    source_id served, found again with a binary search.
+    """
+    cols: Dict[str, np.ndarray]     # source_id, x, y, z, mag, cid
+    ids: np.ndarray                 # distinct cluster ids, ascending
+    starts: np.ndarray              # rows of ids[i] are starts[i]:starts[i + 1]
+
+    @classmethod
+    def build(cls, cols: Dict[str, np.ndarray]) -> "ClusterMembers":
+        order = np.lexsort((cols["source_id"], cols["cid"]))
+        cols = {k: np.asarray(v)[order] for k, v in cols.items()}
+        ids, starts = np.unique(cols["cid"], return_index=True)
+        return cls(cols, ids, np.append(starts, len(order)))
+
+    def page(self, cid: int, cursor: Optional[int], limit: int
+             ) -> Tuple[Dict[str, np.ndarray], int, Optional[int]]:
+        """(member columns, cluster size, next cursor or None).  KeyError if no such cluster."""
+        i = int(np.searchsorted(self.ids, cid))
+        if i == len(self.ids) or self.ids[i] != cid:
+            raise KeyError(cid)
+        lo, hi = int(self.starts[i]), int(self.starts[i + 1])
+        if cursor is not None:
+            lo += int(np.searchsorted(self.cols["source_id"][lo:hi], cursor, side="right"))
+        end = min(lo + limit, hi)
+        nxt = int(self.cols["source_id"][end - 1]) if end < hi else None
+        return {k: v[lo:end] for k, v in self.cols.items()}, hi - int(self.starts[i]), nxt
+
+
+def member_records(mem: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    return [{"x": x, "y": y, "z": z, "mag": m, "cid": c} for x, y, z, m, c in
+            zip(*(mem[k].tolist() for k in ("x", "y", "z", "mag", "cid")))]
+
+
+def _catalog_records(cat: Dict[str, list]) -> List[Dict[str, Any]]:
+    return [{"id": i, "n": n, "name": nm, "x": x, "y": y, "z": z, "dist": d, "bp_rp": bp}
+            for i, n, nm, x, y, z, d, bp in zip(*(cat[k] for k in (
+                "cluster_id", "n", "name", "cx", "cy", "cz", "dist_ly", "mean_bp_rp")))]
+
+
+def _member_columns(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {"source_id": cols["source_id"], "x": cols["X"], "y": cols["Y"], "z": cols["Z"],
+            "mag": cols["mag"], "cid": cols["cluster_id"]}
+
+
+async def query_clusters() -> List[Dict[str, Any]]:
+    """Cluster catalogue, largest first."""
+    return (await aggregate("clusters")).data[0]
+
+
+async def query_cluster_members(cid: int, cursor: Optional[int] = None, limit: int = 5000
+                                ) -> Tuple[Dict[str, np.ndarray], int, Optional[int]]:
+    """One page of cluster `cid`'s members: (columns, cluster size, next cursor)."""
+    members = (await aggregate("clusters")).data[1]
+    return members.page(cid, cursor, max(1, min(limit, MEMBER_PAGE_MAX)))
 
 
 # --------------------------------------------------------------------------- #
 # Mock data (used when BigQuery / precomputed tables are unavailable)
 # --------------------------------------------------------------------------- #
-def _sphere_dirs(n):
-    v = _rng.normal(size=(n, 3))
+def _mock_rng(*key) -> np.random.Generator:
+    """Generator seeded from `key`: the same mock for the same parameters, in every worker."""
+    return np.random.default_rng([MOCK_SEED, zlib.crc32(repr(key).encode())])
+
+
+def _sphere_dirs(rng: np.random.Generator, n: int, flatten: float = 1.0) -> np.ndarray:
+    """n random unit vectors; flatten < 1 squashes z to fake a galactic-plane concentration."""
+    v = rng.normal(size=(n, 3))
+    v[:, 2] *= flatten
     return v / np.linalg.norm(v, axis=1, keepdims=True)
 
 
-def _mock_stars(min_dist, max_dist, limit, year):
-    n = min(limit, 20000)
-    d = _rng.uniform(min_dist, max_dist, n)
-    dirs = _sphere_dirs(n)
-    # fake a galactic-plane concentration
-    dirs[:, 2] *= 0.5
-    dirs /= np.linalg.norm(dirs, axis=1, keepdims=True)
-    p = dirs * d[:, None]
-    mag = _rng.uniform(2, 13, n)
-    return [{"source_id": str(i), "x": float(p[i, 0]), "y": float(p[i, 1]),
-             "z": float(p[i, 2]), "mag": float(mag[i]), "dist": float(d[i])}
-            for i in range(n)]
-
-
-def _mock_density(min_dist, max_dist):
-    out = []
-    for hp in range(192):
-        dirs = _sphere_dirs(1)[0]
-        dirs[2] *= 0.35
-        dirs /= np.linalg.norm(dirs)
-        for b in range(int(min_dist), int(max_dist), 100):
-            disk = np.exp(-abs(dirs[2]) * 3)
-            n = int(_rng.poisson(800 * disk * np.exp(-b / 4000.0)) + 1)
-            c = dirs * (b + 50)
-            out.append({"hp": hp, "bin": b, "n": n, "bp_rp": float(_rng.uniform(0.5, 1.6)),
-                        "x": float(c[0]), "y": float(c[1]), "z": float(c[2])})
-    return out
+@lru_cache(maxsize=1)
+def _mock_pool() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MOCK_MAX_STARS directions, unit distance fractions and magnitudes, drawn once."""
+    rng = _mock_rng("stars")
+    return (_sphere_dirs(rng, MOCK_MAX_STARS, 0.5), rng.random(MOCK_MAX_STARS),
+            rng.uniform(2, 13, MOCK_MAX_STARS))
+
+
+@lru_cache(maxsize=16)
+def _mock_stars(min_dist: float, max_dist: float, limit: int) -> StarBatch:
+    dirs, u, mag = _mock_pool()
+    n = min(int(limit), MOCK_MAX_STARS)
+    d = min_dist + (max_dist - min_dist) * u[:n]
+    return StarBatch(np.arange(n, dtype=np.int64), dirs[:n] * d[:, None], np.zeros((n, 3)),
+                     mag[:n], d)
+
+
+def _mock_cone(disc: healpix.Disc, mag_limit: float, min_dist: float, max_dist: float,
+               limit: int) -> StarBatch:
+    # Filter the pool itself: a full-pool StarBatch per distance range would
+    # sit in _mock_stars' cache at ~64 bytes a star.
+    dirs, u, mag = _mock_pool()
+    idx = np.flatnonzero(disc.contains(dirs[:, 0], dirs[:, 1], dirs[:, 2]) & (mag <= mag_limit))
+    idx = idx[np.argsort(mag[idx], kind="stable")[:limit]]
+    d = min_dist + (max_dist - min_dist) * u[idx]
+    metrics.ROWS.inc(len(idx), source="mock")
+    return StarBatch(idx.astype(np.int64), dirs[idx] * d[:, None], np.zeros((len(idx), 3)),
+                     mag[idx], d)
+
+
+def _mock_lookup(ids: np.ndarray) -> Dict[str, np.ndarray]:
+    """Mock stars are numbered 0..MOCK_MAX_STARS - 1 (see _mock_stars)."""
+    ids = ids[(ids >= 0) & (ids < MOCK_MAX_STARS)]
+    dirs, u, mag = _mock_pool()
+    d = 17000.0 * u[ids]
+    return {"source_id": ids, "x": dirs[ids, 0], "y": dirs[ids, 1], "z": dirs[ids, 2],
+            "vx": np.zeros(len(ids)), "vy": np.zeros(len(ids)), "vz": np.zeros(len(ids)),
+            "phot_g_mean_mag": mag[ids], "distance_ly": d, "bp_rp": np.full(len(ids), np.nan),
+            "has_rvs": np.zeros(len(ids), dtype=bool), "healpix_2": healpix.vec2pix(2, dirs[ids])}
+
+
+def _mock_batch(min_dist: float, max_dist: float, limit: int) -> StarBatch:
+    batch = _mock_stars(min_dist, max_dist, limit)
+    metrics.ROWS.inc(len(batch), source="mock")
+    return batch
+
+
+@lru_cache(maxsize=8)
+def _mock_density(min_dist: int = 0, max_dist: int = 17000) -> Dict[str, np.ndarray]:
+    rng = _mock_rng("density", min_dist, max_dist)
+    dirs = _sphere_dirs(rng, 192, 0.35)
+    bins = np.arange(int(min_dist), int(max_dist), 50)
+    disk = np.exp(-np.abs(dirs[:, 2]) * 3)
+    n = rng.poisson(400 * disk[:, None] * np.exp(-bins / 4000.0)[None, :]) + 1
+    c = dirs[:, None, :] * (bins + 25)[None, :, None]
+    shape = n.shape
+    return {"healpix_2": np.repeat(np.arange(192), len(bins)),
+            "distance_bin": np.tile(bins, 192), "n": n.ravel(),
+            "mean_bp_rp": rng.uniform(0.5, 1.6, shape).ravel(),
+            "cx": c[..., 0].ravel(), "cy": c[..., 1].ravel(), "cz": c[..., 2].ravel()}
 
 
-def _mock_hr():
-    out = []
-    bp = _rng.uniform(-0.4, 3.5, 60000)
-    absmag = 4.5 + 4.0 * bp + _rng.normal(0, 0.6, bp.size)          # main sequence
-    g = _rng.uniform(0.9, 1.6, 8000)                                # giant branch
-    bp = np.concatenate([bp, g]); absmag = np.concatenate([absmag, _rng.normal(0.5, 0.6, g.size)])
-    from collections import Counter
-    c = Counter((round(float(b) / 0.05) * 0.05, round(float(a) / 0.2) * 0.2)
-                for b, a in zip(bp, absmag) if -6 < a < 20)
-    return [{"bp_rp": k[0], "absmag": k[1], "n": v} for k, v in c.items()]
+@lru_cache(maxsize=1)
+def _mock_hr(n_main: int = 60000, n_giant: int = 8000) -> Dict[str, np.ndarray]:
+    rng = _mock_rng("hr", n_main, n_giant)
+    bp = rng.uniform(-0.4, 3.5, n_main)
+    absmag = 4.5 + 4.0 * bp + rng.normal(0, 0.6, n_main)            # main sequence
+    g = rng.uniform(0.9, 1.6, n_giant)                              # giant branch
+    bp = np.concatenate([bp, g])
+    absmag = np.concatenate([absmag, rng.normal(0.5, 0.6, n_giant)])
+    keep = (absmag > -6) & (absmag < 20)
+    k = int(keep.sum())
+    dist = np.minimum(rng.exponential(3000.0, k), 9999.0)
+    # One row per star: HRCube.build sums duplicate cells.
+    return {"healpix_2": rng.integers(0, 192, k),
+            "distance_bin": (dist // HR_SHELL_LY * HR_SHELL_LY).astype(np.int64),
+            "bp_rp_bin": np.round(bp[keep] / 0.05) * 0.05,
+            "absmag_bin": np.round(absmag[keep] / 0.2) * 0.2, "n": np.ones(k, dtype=np.int64)}
 
 
-def _mock_clusters():
+@lru_cache(maxsize=1)
+def _mock_clusters() -> Tuple[List[Dict[str, Any]], ClusterMembers]:
+    rng = _mock_rng("clusters")
     names = ["Hyades", "Pleiades (M45)", "Coma Berenices", "Praesepe (M44)", ""]
-    clusters, stars = [], []
-    for cid, nm in enumerate(names):
-        center = _sphere_dirs(1)[0] * _rng.uniform(120, 580)
-        n = int(_rng.integers(80, 400))
-        pts = center + _rng.normal(0, 12, (n, 3))
-        for p in pts:
-            stars.append({"x": float(p[0]), "y": float(p[1]), "z": float(p[2]),
-                          "mag": float(_rng.uniform(3, 11)), "cid": cid})
-        clusters.append({"id": cid, "n": n, "name": nm,
-                         "x": float(center[0]), "y": float(center[1]), "z": float(center[2]),
-                         "dist": float(np.linalg.norm(center)), "bp_rp": float(_rng.uniform(0.4, 1.4))})
-    return {"clusters": clusters, "stars": stars}
+    centers = _sphere_dirs(rng, len(names)) * rng.uniform(120, 580, (len(names), 1))
+    sizes = rng.integers(80, 400, len(names))
+    cid = np.repeat(np.arange(len(names)), sizes)
+    p = centers[cid] + rng.normal(0, 12, (len(cid), 3))
+    bp_rp = rng.uniform(0.4, 1.4, len(names))
+    clusters = [{"id": i, "n": int(sizes[i]), "name": nm,
+                 "x": float(centers[i, 0]), "y": float(centers[i, 1]), "z": float(centers[i, 2]),
+                 "dist": float(np.linalg.norm(centers[i])), "bp_rp": float(bp_rp[i])}
+                for i, nm in enumerate(names)]
+    clusters.sort(key=lambda c: -c["n"])
+    return clusters, ClusterMembers.build({
+        "source_id": rng.permutation(len(cid)).astype(np.int64),
+        "x": p[:, 0], "y": p[:, 1], "z": p[:, 2], "mag": rng.uniform(3, 11, len(cid)),
+        "cid": cid})
@@ -0,0 +1,171 @@
+"""Nested-scheme HEALPix helpers for cone searches (no healpy dependency).
+
+Gaia encodes the level-12 nested HEALPix pixel of every source in the top
+bits of its source_id: healpix_12 = source_id // 2**35, and the coarser
+levels follow by dropping two bits per level (healpix_2 = healpix_12 // 4**10,
+as in pyspark_code/filtering.py).  Positions are ICRS unit vectors
+(x, y, z) = (cos dec cos ra, cos dec sin ra, sin dec), the same as the
+catalogue's x / y / z columns.
+
+Pixel centres and the covering pixels of a disc follow the HEALPix C++
+library (Gorski et al. 2005); `query_disc` is conservative: it may return a
+few pixels on the rim that the disc misses, never the other way round.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+MAX_ORDER = 12
+SOURCE_ID_PER_HP12 = 2**35      # source_id // 2**35 = level-12 nested pixel
+
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def _spread(v: np.ndarray, order: int) -> np.ndarray:
+    """Interleave zeros between the low `order` bits of v."""
+    out = np.zeros_like(v)
+    for b in range(order):
+        out |= ((v >> b) & 1) << (2 * b)
+    return out
+
+
+def _compact(v: np.ndarray, order: int) -> np.ndarray:
+    """Inverse of _spread: every other bit of v."""
+    out = np.zeros_like(v)
+    for b in range(order):
+        out |= ((v >> (2 * b)) & 1) << b
+    return out
+
+
+def vec(ra_deg, dec_deg) -> np.ndarray:
+    """(…, 3) ICRS unit vectors from RA / Dec in degrees."""
+    ra, dec = np.radians(ra_deg), np.radians(dec_deg)
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def vec2pix(order: int, v: np.ndarray) -> np.ndarray:
+    """Nested pixel index at `order` of unit vectors `v` (…, 3)."""
+    v = np.asarray(v, dtype=float)
+    nside = 1 << order
+    z = np.clip(v[..., 2], -1.0, 1.0)
+    tt = np.mod(np.arctan2(v[..., 1], v[..., 0]), 2 * np.pi) * (2 / np.pi)    # [0, 4)
+    tt = np.where(tt >= 4.0, 0.0, tt)
+    za = np.abs(z)
+
+    # equatorial belt, |z| <= 2/3
+    t1 = nside * (0.5 + tt)
+    t2 = nside * (0.75 * z)
+    jp = (t1 - t2).astype(np.int64)
+    jm = (t1 + t2).astype(np.int64)
+    ifp, ifm = jp >> order, jm >> order
+    face_eq = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix_eq = jm & (nside - 1)
+    iy_eq = nside - (jp & (nside - 1)) - 1
+
+    # polar caps
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    tmp = nside * np.sqrt(3 * (1 - za))
+    jp_c = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm_c = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z >= 0
+    face_cap = np.where(north, ntt, ntt + 8)
+    ix_cap = np.where(north, nside - jm_c - 1, jp_c)
+    iy_cap = np.where(north, nside - jp_c - 1, jm_c)
+
+    eq = za <= 2.0 / 3.0
+    face = np.where(eq, face_eq, face_cap)
+    ix = np.where(eq, ix_eq, ix_cap)
+    iy = np.where(eq, iy_eq, iy_cap)
+    return (face << (2 * order)) + _spread(ix, order) + (_spread(iy, order) << 1)
+
+
+def pix2vec(order: int, pix: np.ndarray) -> np.ndarray:
+    """(N, 3) unit vectors of the centres of nested pixels `pix` at `order`."""
+    pix = np.asarray(pix, dtype=np.int64)
+    nside = 1 << order
+    face = pix >> (2 * order)
+    sub = pix & ((1 << (2 * order)) - 1)
+    ix, iy = _compact(sub, order), _compact(sub >> 1, order)
+
+    jr = _JRLL[face] * nside - ix - iy - 1
+    nr = np.where(jr < nside, jr, np.where(jr > 3 * nside, 4 * nside - jr, nside))
+    fact = 1.0 / (3.0 * nside * nside)
+    z = np.where(jr < nside, 1 - nr * nr * fact,
+                 np.where(jr > 3 * nside, nr * nr * fact - 1,
+                          (2 * nside - jr) * (2.0 / (3.0 * nside))))
+    kshift = np.where((jr >= nside) & (jr <= 3 * nside), (jr - nside) & 1, 0)
+    jp = (_JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, np.where(jp < 1, jp + 4 * nside, jp))
+    phi = (jp - (kshift + 1) * 0.5) * (np.pi / 2 / nr)
+    s = np.sqrt(np.maximum(0.0, 1 - z * z))
+    return np.stack([s * np.cos(phi), s * np.sin(phi), z], axis=-1)
+
+
+def _z_phi(z: float, phi: float) -> np.ndarray:
+    s = np.sqrt(max(0.0, 1 - z * z))
+    return np.array([s * np.cos(phi), s * np.sin(phi), z])
+
+
+def max_pixrad(order: int) -> float:
+    """Largest angle (rad) between a pixel's centre and any of its corners."""
+    nside = 1 << order
+    t1 = (1.0 - 1.0 / nside) ** 2
+    a, b = _z_phi(2.0 / 3.0, np.pi / (4 * nside)), _z_phi(1 - t1 / 3, 0.0)
+    return float(np.arccos(np.clip(a @ b, -1.0, 1.0)))
+
+
+def order_for_radius(radius_deg: float, max_order: int = MAX_ORDER) -> int:
+    """Finest order whose pixels are still about half the disc radius across,
+    so a cover is a few dozen pixels whatever the radius."""
+    size = np.degrees(np.sqrt(4 * np.pi / 12))              # level-0 pixel, ~58.6 deg
+    return int(np.clip(np.ceil(np.log2(2 * size / max(radius_deg, 1e-6))), 0, max_order))
+
+
+def query_disc(order: int, center: np.ndarray, radius: float) -> np.ndarray:
+    """Sorted nested pixels at `order` overlapping the disc of `radius` rad
+    around unit vector `center`, found top-down from the 12 base pixels."""
+    pix = np.arange(12, dtype=np.int64)
+    for o in range(order + 1):
+        if o:
+            pix = (pix[:, None] * 4 + np.arange(4)).ravel()
+        reach = min(np.pi, radius + max_pixrad(o))
+        pix = pix[pix2vec(o, pix) @ center >= np.cos(reach)]
+    return pix
+
+
+def source_id_divisor(order: int) -> int:
+    """source_id // this = nested pixel at `order`."""
+    return SOURCE_ID_PER_HP12 * 4 ** (MAX_ORDER - order)
+
+
+def healpix_2(source_id):
+    """Level-2 pixel (the healpix_2 partition) encoded in Gaia source_id(s)."""
+    return source_id // source_id_divisor(2)
+
+
+@dataclass(frozen=True)
+class Disc:
+    """A cone on the sky and its cover: nested pixels at `order`, and the
+    level-2 pixels (the healpix_2 partitions) that contain them."""
+    center: np.ndarray      # unit vector
+    cos_radius: float
+    order: int
+    pixels: np.ndarray      # sorted, at `order`
+    healpix_2: np.ndarray   # sorted
+
+    @classmethod
+    def cover(cls, ra_deg: float, dec_deg: float, radius_deg: float) -> "Disc":
+        center = vec(ra_deg, dec_deg)
+        order = max(2, order_for_radius(radius_deg))
+        pixels = query_disc(order, center, np.radians(radius_deg))
+        return cls(center, float(np.cos(np.radians(radius_deg))), order, pixels,
+                   np.unique(pixels >> (2 * (order - 2))))
+
+    def contains(self, x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """Exact test for unit vectors: inside the cone."""
+        c = self.center
+        return x * c[0] + y * c[1] + z * c[2] >= self.cos_radius
@@ -0,0 +1,347 @@
+"""Local Parquet backend for Galaxy Explorer.
+
+Serves the same views as the BigQuery path in db.py, straight off the
+`gaia_ly` tree written by pyspark_code/ly_partitioning.py:
+
+  <GAIA_LOCAL_DIR>/bin_<distance_bin>/<stem>_bin_<distance_bin>.parquet
+
+On first use we read every file footer once and keep a flat index with one
+entry per row group: (file, row group, distance_bin, healpix_2 min/max,
+distance_ly min/max, rows).  Queries prune that index first, then read only
+the surviving row groups and only the requested columns, so a sector / shell
+query touches a tiny slice of the 77 GB.  The index is persisted next to the
+data (`_index.parquet`) and rebuilt when any bin directory is newer.
+
+The precomputed aggregates are plain Parquet files in the same root, written
+by bq_jobs/build_local.py (density, pyramid, hr) and exported from clustering.py:
+
+  density_voxels.parquet  density_pyramid.parquet  hr_bins.parquet
+  cluster_catalog.parquet  cluster_stars.parquet
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sampling import SAMPLE_TIERS, sample_tier
+
+from . import healpix
+from .cache import ByteLRU
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.getenv("GAIA_LOCAL_DIR", "")
+INDEX_FILE = "_index.parquet"
+BIN_WIDTH = 50   # ly, matches ly_partitioning.py
+
+# Missing files / columns and malformed Parquet (pyarrow raises ValueError subclasses).
+ERRORS = (OSError, KeyError, ValueError)
+
+STAR_COLUMNS = ["source_id", "x", "y", "z", "vx", "vy", "vz",
+                "phot_g_mean_mag", "distance_ly"]
+LOOKUP_COLUMNS = STAR_COLUMNS + ["bp_rp", "has_rvs", "healpix_2"]
+
+# Per-healpix_2 sorted source_id -> (row group, row) indexes for lookups.
+ID_INDEX_BYTES = int(float(os.getenv("ID_INDEX_MB", "256")) * 2**20)
+id_index_cache = ByteLRU("id_index", ID_INDEX_BYTES)
+
+_INDEX_SCHEMA = pa.schema([
+    ("path", pa.string()), ("row_group", pa.int32()), ("distance_bin", pa.int32()),
+    ("hp_min", pa.int64()), ("hp_max", pa.int64()),
+    ("d_min", pa.float64()), ("d_max", pa.float64()), ("rows", pa.int64()),
+    ("tier_min", pa.int32()), ("tier_max", pa.int32()), ("has_tier", pa.bool_()),
+])
+
+
+def enabled() -> bool:
+    return bool(ROOT) and Path(ROOT).is_dir()
+
+
+# --------------------------------------------------------------------------- #
+# Row-group index
+# --------------------------------------------------------------------------- #
+class RowGroupIndex:
+    """Flat (healpix_2, distance_bin) index over every row group under `root`."""
+
+    def __init__(self, root: Path, table: pa.Table):
+        self.root = root
+        self.paths = np.asarray(table["path"].to_pylist(), dtype=object)
+        self.row_group = table["row_group"].to_numpy()
+        self.distance_bin = table["distance_bin"].to_numpy()
+        self.hp_min = table["hp_min"].to_numpy()
+        self.hp_max = table["hp_max"].to_numpy()
+        self.d_min = table["d_min"].to_numpy()
+        self.d_max = table["d_max"].to_numpy()
+        self.rows = table["rows"].to_numpy()
+        self.tier_min = table["tier_min"].to_numpy()
+        self.has_tier = table["has_tier"].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def select(self, min_dist: float, max_dist: float,
+               hp: Optional[Tuple[int, int]] = None, tiers: int = SAMPLE_TIERS,
+               pixels: Optional[np.ndarray] = None) -> np.ndarray:
+        """Positions of the row groups that may hold rows in range, nearest shells first.
+
+        `pixels` (sorted healpix_2 values) keeps row groups that span any of them.
+        """
+        m = ((self.distance_bin <= max_dist) & (self.distance_bin + BIN_WIDTH > min_dist)
+             & (self.d_max >= min_dist) & (self.d_min <= max_dist))
+        if hp:
+            m &= (self.hp_max >= hp[0]) & (self.hp_min <= hp[1])
+        if pixels is not None:
+            m &= (np.searchsorted(pixels, self.hp_min)
+                  < np.searchsorted(pixels, self.hp_max, side="right"))
+        if tiers < SAMPLE_TIERS:
+            m &= self.tier_min < tiers
+        idx = np.flatnonzero(m)
+        return idx[np.argsort(self.distance_bin[idx], kind="stable")]
+
+
+def _stat(rg_meta, col: int, default):
+    st = rg_meta.column(col).statistics
+    if st is None or not st.has_min_max:
+        return default
+    return st.min, st.max
+
+
+def _scan_file(path: Path, rel: str, dbin: int) -> List[tuple]:
+    meta = pq.ParquetFile(path).metadata
+    names = [meta.schema.column(i).name for i in range(meta.num_columns)]
+    hp_col, d_col = names.index("healpix_2"), names.index("distance_ly")
+    t_col = names.index("sample_tier") if "sample_tier" in names else None
+    out = []
+    for g in range(meta.num_row_groups):
+        rg = meta.row_group(g)
+        hp_lo, hp_hi = _stat(rg, hp_col, (0, 191))
+        d_lo, d_hi = _stat(rg, d_col, (float(dbin), float(dbin + BIN_WIDTH)))
+        t_lo, t_hi = (_stat(rg, t_col, (0, SAMPLE_TIERS - 1)) if t_col is not None
+                      else (0, SAMPLE_TIERS - 1))
+        out.append((rel, g, dbin, int(hp_lo), int(hp_hi), float(d_lo), float(d_hi),
+                    rg.num_rows, int(t_lo), int(t_hi), t_col is not None))
+    return out
+
+
+def _bin_dirs(root: Path) -> List[Tuple[int, Path]]:
+    dirs = []
+    for p in root.glob("bin_*"):
+        try:
+            dirs.append((int(p.name[4:]), p))
+        except ValueError:
+            continue
+    return sorted(dirs)
+
+
+def build_index(root: Path) -> pa.Table:
+    t0 = time.perf_counter()
+    rows = []
+    for dbin, d in _bin_dirs(root):
+        for f in sorted(d.glob("*.parquet")):
+            if f.name.startswith("._"):
+                continue  # macOS resource forks on external drives
+            rows.extend(_scan_file(f, str(f.relative_to(root)), dbin))
+    cols = list(zip(*rows)) if rows else [[] for _ in _INDEX_SCHEMA]
+    table = pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(cols, _INDEX_SCHEMA)],
+                                 schema=_INDEX_SCHEMA)
+    logger.info(f"indexed {len(rows):,} row groups under {root} in "
+                f"{time.perf_counter() - t0:.1f}s")
+    return table
+
+
+def _load_or_build(root: Path) -> pa.Table:
+    cached = root / INDEX_FILE
+    newest = max((d.stat().st_mtime for _, d in _bin_dirs(root)), default=0.0)
+    if cached.exists() and cached.stat().st_mtime >= newest:
+        table = pq.read_table(cached)
+        if table.schema.equals(_INDEX_SCHEMA):
+            return table
+    table = build_index(root)
+    try:
+        pq.write_table(table, cached)
+    except OSError as exc:
+        logger.warning(f"couldn't persist row-group index ({exc}); keeping it in memory.")
+    return table
+
+
+_index: Optional[RowGroupIndex] = None
+_index_lock = threading.Lock()
+
+
+def index() -> RowGroupIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                root = Path(ROOT)
+                _index = RowGroupIndex(root, _load_or_build(root))
+    return _index
+
+
+@lru_cache(maxsize=256)
+def _parquet(path: str) -> pq.ParquetFile:
+    return pq.ParquetFile(path, memory_map=True)
+
+
+def _read_group(ix: RowGroupIndex, i: int, columns: List[str]) -> pa.Table:
+    return _parquet(str(ix.root / ix.paths[i])).read_row_group(int(ix.row_group[i]),
+                                                               columns=columns)
+
+
+# --------------------------------------------------------------------------- #
+# Queries (synchronous; db.py wraps them)
+# --------------------------------------------------------------------------- #
+def stars(min_dist: float, max_dist: float, hp: Optional[Tuple[int, int]],
+          limit: int, tiers: int = SAMPLE_TIERS) -> Dict[str, np.ndarray]:
+    """Same rows as the `stars` SQL in db.py, as NumPy columns.
+
+    `tiers` < SAMPLE_TIERS keeps only rows with sample_tier < tiers, from every
+    shell, and then the `limit` lowest tiers, so the headroom is cut evenly
+    rather than from the far shells.  Row groups are read lowest tiers first
+    (ly_partitioning.py writes them by tier band) and the read stops once
+    `limit` rows lie below every unread group's tiers.  Files written before
+    the column existed get it hashed from source_id.  Unsampled reads stop at
+    `limit`.
+    """
+    ix = index()
+    sampled = tiers < SAMPLE_TIERS
+    groups = ix.select(min_dist, max_dist, hp, tiers)
+    if sampled:
+        groups = groups[np.argsort(ix.tier_min[groups], kind="stable")]
+        per_tier = np.zeros(SAMPLE_TIERS, dtype=np.int64)   # rows kept so far
+    parts, n = [], 0
+    for i in groups:
+        if sampled and per_tier[:ix.tier_min[i]].sum() >= limit:
+            break
+        stored = sampled and ix.has_tier[i]
+        t = _read_group(ix, i, STAR_COLUMNS + ["healpix_2"] + (["sample_tier"] if stored else []))
+        mask = pc.and_(pc.and_(pc.greater_equal(t["distance_ly"], min_dist),
+                               pc.less_equal(t["distance_ly"], max_dist)),
+                       pc.is_valid(t["phot_g_mean_mag"]))
+        if hp:
+            mask = pc.and_(mask, pc.and_(pc.greater_equal(t["healpix_2"], hp[0]),
+                                         pc.less_equal(t["healpix_2"], hp[1])))
+        t = t.filter(mask).select(STAR_COLUMNS + (["sample_tier"] if stored else []))
+        if sampled:
+            tier = (t["sample_tier"].to_numpy() if stored
+                    else sample_tier(t["source_id"].to_numpy()))
+            keep = tier < tiers
+            t = t.select(STAR_COLUMNS).filter(pa.array(keep))
+            t = t.append_column("sample_tier", pa.array(tier[keep], type=pa.int32()))
+            per_tier += np.bincount(tier[keep], minlength=SAMPLE_TIERS)
+        if t.num_rows:
+            parts.append(t)
+            n += t.num_rows
+        if not sampled and n >= limit:
+            break
+    if not parts:
+        return {c: np.empty(0) for c in STAR_COLUMNS}
+    t = pa.concat_tables(parts)
+    if sampled:
+        t = t.take(pc.sort_indices(t, [("sample_tier", "ascending")]))
+    t = t.slice(0, limit)
+    return {c: t[c].to_numpy() for c in STAR_COLUMNS}
+
+
+def cone(disc: healpix.Disc, min_dist: float, max_dist: float, mag_limit: float,
+         limit: int) -> Dict[str, np.ndarray]:
+    """Stars inside `disc`, brightest first, as NumPy columns.
+
+    Reads only the row groups of the disc's healpix_2 partitions.  Rows are
+    first kept by the fine pixel in their source_id (an integer test), then
+    by the exact angular distance.
+    """
+    ix = index()
+    div = healpix.source_id_divisor(disc.order)
+    parts = []
+    for i in ix.select(min_dist, max_dist, pixels=disc.healpix_2):
+        t = _read_group(ix, i, STAR_COLUMNS)
+        t = t.filter(pa.array(np.isin(t["source_id"].to_numpy() // div, disc.pixels)))
+        if not t.num_rows:
+            continue
+        c = {k: t[k].to_numpy(zero_copy_only=False) for k in STAR_COLUMNS}
+        with np.errstate(invalid="ignore"):
+            m = (disc.contains(c["x"], c["y"], c["z"]) & (c["phot_g_mean_mag"] <= mag_limit)
+                 & (c["distance_ly"] >= min_dist) & (c["distance_ly"] <= max_dist))
+        parts.append({k: v[m] for k, v in c.items()})
+    if not parts:
+        return {c: np.empty(0) for c in STAR_COLUMNS}
+    cols = {k: np.concatenate([p[k] for p in parts]) for k in STAR_COLUMNS}
+    order = np.argsort(cols["phot_g_mean_mag"], kind="stable")[:limit]
+    return {k: v[order] for k, v in cols.items()}
+
+
+def _id_index(hp2: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(sorted source_ids, row-group position, row) of every star in partition
+    `hp2`, built from the source_id column of its row groups on first use."""
+    cached = id_index_cache.get(hp2)
+    if cached is not None:
+        return cached
+    ix = index()
+    ids, groups, rows = [], [], []
+    for i in ix.select(0, float("inf"), (hp2, hp2)):
+        t = _read_group(ix, i, ["source_id", "healpix_2"])
+        r = np.flatnonzero(t["healpix_2"].to_numpy() == hp2)
+        ids.append(t["source_id"].to_numpy()[r])
+        groups.append(np.full(len(r), i, dtype=np.int32))
+        rows.append(r.astype(np.int32))
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    out = (ids[order], np.concatenate(groups)[order] if groups else np.empty(0, np.int32),
+           np.concatenate(rows)[order] if rows else np.empty(0, np.int32))
+    id_index_cache.put(hp2, out, sum(a.nbytes for a in out))
+    return out
+
+
+def lookup(source_ids: np.ndarray) -> Dict[str, np.ndarray]:
+    """LOOKUP_COLUMNS of the stars with these source_ids (missing ones are
+    absent).  Each id is routed to its healpix_2 partition by its top bits and
+    found by binary search in that partition's id index."""
+    ix = index()
+    source_ids = np.unique(np.asarray(source_ids, dtype=np.int64))
+    where: List[Tuple[int, int]] = []
+    for hp2 in np.unique(healpix.healpix_2(source_ids)).tolist():
+        if not 0 <= hp2 < 192:
+            continue
+        ids, groups, rows = _id_index(hp2)
+        want = source_ids[healpix.healpix_2(source_ids) == hp2]
+        pos = np.minimum(np.searchsorted(ids, want), max(len(ids) - 1, 0))
+        hit = pos[ids[pos] == want] if len(ids) else pos[:0]
+        where.extend(zip(groups[hit].tolist(), rows[hit].tolist()))
+    where = np.asarray(where, dtype=np.int64).reshape(-1, 2)
+    parts = [_read_group(ix, g, LOOKUP_COLUMNS).take(pa.array(where[where[:, 0] == g, 1]))
+             for g in np.unique(where[:, 0]).tolist()]
+    if not parts:
+        return {c: np.empty(0) for c in LOOKUP_COLUMNS}
+    t = pa.concat_tables(parts)
+    return {c: t[c].to_numpy(zero_copy_only=False) for c in LOOKUP_COLUMNS}
+
+
+def _aggregate_path(name: str) -> Path:
+    path = Path(ROOT) / f"{name}.parquet"
+    if not path.exists():
+        raise FileNotFoundError(f"{path} (run bq_jobs/build_local.py)")
+    return path
+
+
+def version(name: str) -> str:
+    """Version stamp of aggregate `name`: its file mtime."""
+    return f"{name}@{_aggregate_path(name).stat().st_mtime_ns}"
+
+
+def table(name: str, columns: Optional[List[str]] = None,
+          limit: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Aggregate `name` (e.g. density_voxels) as NumPy columns."""
+    t = pq.read_table(_aggregate_path(name), columns=columns)
+    if limit is not None:
+        t = t.slice(0, limit)
+    return {c: t[c].to_numpy() for c in t.column_names}
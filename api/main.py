@@ -1,13 +1,34 @@
-from fastapi import FastAPI, HTTPException
+import time
+_IMPORT_T0 = time.perf_counter()     # cold-start accounting: before anything heavy
+
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Tuple, Optional
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Tuple, Optional
+import asyncio
+import hashlib
+import logging
 import os
-from . import db
+import orjson
+from . import db, metrics, tiles, wire
+from .compression import CompressionMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: the worker accepts requests straight away,
+    # and requests that need something still loading simply join that load.
+    warm = asyncio.create_task(db.warm_up())
+    yield
+    warm.cancel()
 
-app = FastAPI(title="Universe API")
+
+app = FastAPI(title="Universe API", lifespan=lifespan)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -17,18 +38,114 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+_served_first = False
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    global _served_first
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    dt = time.perf_counter() - t0
+    metrics.REQUESTS.observe(dt, route=route, method=request.method,
+                             status=response.status_code)
+    if not _served_first:
+        _served_first = True
+        metrics.STARTUP.set(dt, phase="first_request")
+        logger.info(f"first request ({request.method} {route}) took {dt * 1000:.0f} ms, "
+                    f"{t0 - _IMPORT_T0:.1f}s after import started")
+    return response
+
 
 class StarQuery(BaseModel):
     min_dist: float
     max_dist: float
     healpix: Optional[int] = None  # 1-12 or None
+    year: int = 2016               # projected server-side; see /stars/ephemeris
+
+
+class ConeQuery(BaseModel):
+    ra: float = Field(..., ge=0, lt=360)         # degrees, ICRS
+    dec: float = Field(..., ge=-90, le=90)
+    radius: float = Field(..., gt=0, le=90)      # degrees
+    mag_limit: float = 21.0                      # Gaia G, fainter stars are dropped
+    min_dist: float = 0
+    max_dist: float = 17000
+    limit: int = Field(5000, ge=1, le=db.CONE_MAX_STARS)
     year: int = 2016
 
 
+class SpatialQuery(BaseModel):
+    source_id: Optional[int] = None              # centre on this star ...
+    x: Optional[float] = None                    # ... or on this point (ly, J2016)
+    y: Optional[float] = None
+    z: Optional[float] = None
+    min_dist: float = 0                          # the /stars sample to search
+    max_dist: float = 17000
+    year: int = 2016
+
+
+class NeighborQuery(SpatialQuery):
+    k: int = Field(50, ge=1, le=db.SPATIAL_MAX_STARS)
+
+
+class WithinQuery(SpatialQuery):
+    radius: float = Field(..., gt=0)             # ly
+    limit: int = Field(5000, ge=1, le=db.SPATIAL_MAX_STARS)
+
+
+class LookupQuery(BaseModel):
+    source_ids: List[int] = Field(..., min_length=1, max_length=db.LOOKUP_MAX_IDS)
+
+
+class HRQuery(BaseModel):
+    min_dist: float = 0
+    max_dist: float = 17000
+    healpix: Optional[int] = None
+
+
 class DensityQuery(BaseModel):
     min_dist: float = 0
     max_dist: float = 17000
     healpix: Optional[int] = None
+    lod: Optional[int] = Field(None, ge=0, le=len(db.DENSITY_LODS) - 1)  # None: from range
+
+
+def _json(payload) -> Response:
+    """Payload already holds plain floats/strs: skip jsonable_encoder's per-value walk."""
+    with metrics.stage("serialize"):
+        return Response(orjson.dumps(payload), media_type="application/json")
+
+
+def _binary(media: str, columns, dtypes, meta=None) -> Response:
+    with metrics.stage("serialize"):
+        return Response(wire.encode(media, columns, dtypes, meta), media_type=media)
+
+
+DISCONNECT_POLL_S = 0.25
+
+
+async def _guarded(request: Request, coro):
+    """Await a db query, cancelling it if the client disconnects first.
+
+    Queries that hit db.QUERY_TIMEOUT_S surface as 504.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="client disconnected")
+    except db.QueryTimeout as exc:
+        raise HTTPException(status_code=504, detail=str(exc))
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 @app.get("/health")
@@ -36,37 +153,358 @@ def health_check():
     return {"status": "ok"}
 
 
-@app.post("/stars")
-async def get_stars(query: StarQuery):
-    """Sampled 3D star scatter for a distance range / sector, projected to a year."""
+@app.get("/stats/cache")
+def cache_stats():
+    """Hit / miss counters of the in-process result caches and query coalescing."""
+    return _cache_stats()
+
+
+def _cache_stats():
+    return {"stars": db.star_cache.stats(), "spatial": db.spatial_cache.stats(),
+            "tiles": tiles.tile_cache.stats(), "inflight": db.inflight.stats()}
+
+
+metrics.collector(lambda: metrics.cache_lines(_cache_stats()))
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition: per-route and per-stage latency, rows, BigQuery cost."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _star_limit(query: StarQuery) -> int:
     # Density-based limit: more stars for wider distance ranges, fewer per sector.
     scale = min(1.0, query.max_dist / 17000.0)
     limit = int(18000 + (100000 - 18000) * scale)
     if query.healpix is not None:
         limit = max(5000, limit // 4)
-    stars = await db.query_stars(query.min_dist, query.max_dist,
-                                 query.healpix, limit, query.year)
-    return {"count": len(stars), "stars": stars}
+    return limit
+
+
+@app.post("/stars")
+async def get_stars(query: StarQuery, request: Request,
+                    accept: Optional[str] = Header(None)):
+    """Sampled 3D star scatter for a distance range / sector, projected to a year.
+
+    JSON by default; send `Accept: application/x-galaxy-columns` (or the Arrow
+    stream type) for float32 x/y/z/mag/dist columns, see wire.py.
+    """
+    batch = await _guarded(request, db.query_star_batch(
+        query.min_dist, query.max_dist, query.healpix, _star_limit(query)))
+    media = wire.negotiate(accept)
+    if media != wire.JSON:
+        p = batch.positions(query.year)
+        cols = {"x": p[:, 0], "y": p[:, 1], "z": p[:, 2], "mag": batch.mag, "dist": batch.dist}
+        return _binary(media, cols, {})
+    stars = batch.records(query.year)
+    return _json({"count": len(stars), "stars": stars})
+
+
+@app.post("/stars/ephemeris")
+async def get_ephemeris(query: StarQuery, request: Request,
+                        accept: Optional[str] = Header(None)):
+    """Same sample as /stars, unprojected: J2016 position (ly) and linear
+    velocity (ly/yr), so the client animates any year as pos + vel * (year - 2016)
+    without refetching.  `year` is ignored.
+
+    Binary responses carry x/y/z/vx/vy/vz/mag/dist as float32 columns, with the
+    epoch as metadata.
+    """
+    batch = await _guarded(request, db.query_star_batch(
+        query.min_dist, query.max_dist, query.healpix, _star_limit(query)))
+    media = wire.negotiate(accept)
+    if media != wire.JSON:
+        p, v = batch.pos, batch.vel
+        cols = {"x": p[:, 0], "y": p[:, 1], "z": p[:, 2], "vx": v[:, 0], "vy": v[:, 1],
+                "vz": v[:, 2], "mag": batch.mag, "dist": batch.dist}
+        return _binary(media, cols, {}, {"epoch": 2016.0})
+    stars = batch.ephemeris()
+    return _json({"count": len(stars), "epoch": 2016.0, "stars": stars})
+
+
+@app.get("/cone")
+async def get_cone(request: Request, query: ConeQuery = Depends(),
+                   accept: Optional[str] = Header(None)):
+    """Stars within `radius` degrees of (ra, dec), brightest first, down to
+    `mag_limit`.  Only the HEALPix partitions under the cone are read.
+
+    Same response formats as POST /stars.
+    """
+    batch = await _guarded(request, db.query_cone(
+        query.ra, query.dec, query.radius, query.mag_limit,
+        query.min_dist, query.max_dist, query.limit))
+    media = wire.negotiate(accept)
+    if media != wire.JSON:
+        p = batch.positions(query.year)
+        cols = {"x": p[:, 0], "y": p[:, 1], "z": p[:, 2], "mag": batch.mag, "dist": batch.dist}
+        return _binary(media, cols, {})
+    stars = batch.records(query.year)
+    return _json({"count": len(stars), "stars": stars})
+
+
+def _spatial_args(query: SpatialQuery):
+    """(centre, source_id, sample limit) of a /neighbors or /within query."""
+    if query.source_id is None and None in (query.x, query.y, query.z):
+        raise HTTPException(status_code=422, detail="pass source_id or all of x, y, z")
+    limit = _star_limit(StarQuery(min_dist=query.min_dist, max_dist=query.max_dist))
+    return (query.x, query.y, query.z), query.source_id, limit
+
+
+def _spatial_response(batch: db.StarBatch, sep, query: SpatialQuery, media: str) -> Response:
+    if media != wire.JSON:
+        p = batch.positions(query.year)
+        cols = {"x": p[:, 0], "y": p[:, 1], "z": p[:, 2], "mag": batch.mag,
+                "dist": batch.dist, "sep": sep}
+        return _binary(media, cols, {})
+    stars = batch.records(query.year)
+    for star, d in zip(stars, sep.tolist()):
+        star["sep"] = d
+    return _json({"count": len(stars), "stars": stars})
+
+
+@app.get("/neighbors")
+async def get_neighbors(request: Request, query: NeighborQuery = Depends(),
+                        accept: Optional[str] = Header(None)):
+    """The `k` stars nearest a star (`source_id`, itself excluded) or a point
+    (x, y, z in ly), nearest first, each with its separation `sep` in ly.
+
+    Searches the same sample POST /stars serves for the distance range, through
+    an in-memory spatial index built once per sample.  Separations are
+    measured at J2016; positions are projected to `year`.
+    """
+    center, source_id, limit = _spatial_args(query)
+    try:
+        batch, sep = await _guarded(request, db.query_neighbors(
+            center, source_id, query.k, query.min_dist, query.max_dist, limit))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no star {source_id}")
+    return _spatial_response(batch, sep, query, wire.negotiate(accept))
+
+
+@app.get("/within")
+async def get_within(request: Request, query: WithinQuery = Depends(),
+                     accept: Optional[str] = Header(None)):
+    """Stars within `radius` ly of a star or a point, nearest first (at most
+    `limit`); same sample, centre and response format as /neighbors."""
+    center, source_id, limit = _spatial_args(query)
+    try:
+        batch, sep = await _guarded(request, db.query_within(
+            center, source_id, query.radius, query.min_dist, query.max_dist, limit,
+            query.limit))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no star {source_id}")
+    return _spatial_response(batch, sep, query, wire.negotiate(accept))
+
+
+@app.get("/star/{source_id}")
+async def get_star(source_id: int, request: Request):
+    """One star by Gaia source_id (click-to-inspect): position, magnitude, colour."""
+    found, _ = await _guarded(request, db.lookup_stars([source_id]))
+    if not found:
+        raise HTTPException(status_code=404, detail=f"no star {source_id}")
+    return _json(found[0])
+
+
+@app.post("/stars/lookup")
+async def lookup_stars(query: LookupQuery, request: Request):
+    """Batch of stars by source_id (ints or strings); unknown ids come back in `missing`."""
+    found, missing = await _guarded(request, db.lookup_stars(query.source_ids))
+    return _json({"count": len(found), "stars": found, "missing": [str(i) for i in missing]})
+
+
+@app.post("/stars/stream")
+async def stream_stars(query: StarQuery, request: Request, chunk: int = 5000):
+    """Same sample as /stars as NDJSON, brightest first, in chunks.
+
+    Only serialisation and transfer are streamed: the sample is fetched whole
+    (or taken from star_cache) before the first line goes out, so a client can
+    draw the bright stars while the faint ones are still downloading.
+
+    First line: {"count": N}; then one star object per line.
+    """
+    batch = await _guarded(request, db.query_star_batch(
+        query.min_dist, query.max_dist, query.healpix, _star_limit(query)))
+    chunk = max(500, min(chunk, 50000))
+
+    async def lines():
+        yield orjson.dumps({"count": len(batch)}, option=orjson.OPT_APPEND_NEWLINE)
+        for part in db.brightest_first(batch, chunk):
+            records = part.records(query.year)
+            with metrics.stage("serialize"):
+                body = b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE)
+                                for r in records)
+            yield body
+            await asyncio.sleep(0)   # let other requests run between chunks
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# --- Aggregates: ETag + Cache-Control -------------------------------------- #
+AGG_MAX_AGE_S = int(os.getenv("AGG_MAX_AGE_S", "300"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def _etag(*parts) -> str:
+    return '"' + hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20] + '"'
+
+
+def _cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Vary": "Accept",
+            "Cache-Control": f"public, max-age={AGG_MAX_AGE_S}, stale-while-revalidate=86400"}
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """The 304 for a client that already holds `etag`, else None."""
+    inm = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in inm.split(",") if t.strip()}
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return None
+
+
+def _conditional(request: Request, etag: str, build) -> Response:
+    """304 if the client already holds `etag`, else build() with caching headers."""
+    resp = _not_modified(request, etag)
+    if resp is None:
+        resp = build()
+        resp.headers.update(_cache_headers(etag))
+    return resp
+
+
+async def _density(query: DensityQuery, request: Request) -> Response:
+    # The picked lod follows from the version and the query, so revalidation
+    # is answered before any voxel records are built.
+    version = await _guarded(request, db.aggregate_version("density"))
+    etag = _etag("density", version, query.lod, query.min_dist, query.max_dist, query.healpix)
+    resp = _not_modified(request, etag)
+    if resp is not None:
+        return resp
+    lod, voxels = await _guarded(request, db.query_density(query.min_dist, query.max_dist,
+                                                           query.healpix, query.lod))
+    hp_level, shell = db.DENSITY_LODS[lod]
+    return _conditional(request, etag, lambda: _json(
+        {"count": len(voxels), "lod": lod, "healpix_level": hp_level, "shell_ly": shell,
+         "voxels": voxels}))
+
+
+@app.get("/density")
+async def get_density(request: Request, query: DensityQuery = Depends()):
+    """Precomputed stellar-density voxels (healpix x distance shell); cacheable.
+
+    Coarser levels of detail (`lod` 1-3: merged shells and healpix pixels) are
+    picked automatically so the payload stays at a few thousand voxels.
+    """
+    return await _density(query, request)
 
 
 @app.post("/density")
-async def get_density(query: DensityQuery):
-    """Precomputed stellar-density voxels (healpix x distance shell)."""
-    voxels = await db.query_density(query.min_dist, query.max_dist, query.healpix)
-    return {"count": len(voxels), "voxels": voxels}
+async def post_density(query: DensityQuery, request: Request):
+    """Same as GET /density, for clients that send a JSON body."""
+    return await _density(query, request)
 
 
 @app.get("/hr")
-async def get_hr():
-    """Precomputed Hertzsprung-Russell (colour-magnitude) histogram."""
-    bins = await db.query_hr()
-    return {"count": len(bins), "bins": bins}
+async def get_hr(request: Request, query: HRQuery = Depends()):
+    """Precomputed Hertzsprung-Russell (colour-magnitude) histogram, optionally
+    for one sector and distance range only (same filters as /density)."""
+    version = await _guarded(request, db.aggregate_version("hr"))
+    etag = _etag("hr", version, query.min_dist, query.max_dist, query.healpix)
+    resp = _not_modified(request, etag)
+    if resp is not None:
+        return resp
+    bins = await _guarded(request, db.query_hr(query.min_dist, query.max_dist, query.healpix))
+    return _conditional(request, etag, lambda: _json({"count": len(bins), "bins": bins}))
 
 
 @app.get("/clusters")
-async def get_clusters():
-    """Open clusters / moving groups: catalogue + sampled members."""
-    return await db.query_clusters()
+async def get_clusters(request: Request):
+    """Open clusters / moving groups: the catalogue only (members: /clusters/{id}/members)."""
+    version = await _guarded(request, db.aggregate_version("clusters"))
+    clusters = await _guarded(request, db.query_clusters())
+    return _conditional(request, _etag("clusters", version),
+                        lambda: _json({"clusters": clusters}))
+
+
+@app.get("/clusters/{cid}/members")
+async def get_cluster_members(cid: int, request: Request, cursor: Optional[str] = None,
+                              limit: int = 5000, accept: Optional[str] = Header(None)):
+    """One page of a cluster's member stars, in source_id order.
+
+    Pass the returned `next_cursor` back as `cursor` for the next page; it is
+    null on the last one.  Binary responses carry x/y/z/mag (float32) + cid
+    (int32) columns with total / next_cursor as metadata, see wire.py.
+    """
+    try:
+        after = int(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bad cursor")
+    version = await _guarded(request, db.aggregate_version("clusters"))
+    try:
+        mem, total, nxt = await _guarded(request, db.query_cluster_members(cid, after, limit))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no cluster {cid}")
+    nxt = str(nxt) if nxt is not None else None     # source_ids overflow JS numbers
+    media = wire.negotiate(accept)
+
+    def build():
+        if media != wire.JSON:
+            cols = {k: mem[k] for k in ("x", "y", "z", "mag", "cid")}
+            return _binary(media, cols, {"cid": "i4"}, {"total": total, "next_cursor": nxt})
+        return _json({"cluster": cid, "total": total, "count": len(mem["cid"]),
+                      "stars": db.member_records(mem), "next_cursor": nxt})
+    return _conditional(request, _etag("members", version, cid, cursor, limit, media), build)
+
+
+# --- Octree tiles (bq_jobs/build_tiles.py) -------------------------------- #
+def _tiles_version() -> str:
+    if not tiles.enabled():
+        raise HTTPException(status_code=503, detail="no octree tiles (run bq_jobs/build_tiles.py)")
+    return tiles.version()
+
+
+@app.get("/tiles/meta")
+def get_tiles_meta(request: Request):
+    """Octree layout: cube half-size, depth, points per node and the node list."""
+    version = _tiles_version()
+    return _conditional(request, _etag(version), lambda: _json(tiles.meta()))
+
+
+@app.get("/tiles/{level}/{x}/{y}/{z}")
+def get_tile(level: int, x: int, y: int, z: int, request: Request,
+             accept: Optional[str] = Header(None)):
+    """One octree node: x/y/z (ly) + mag of the stars it adds at this level of detail.
+
+    Binary Accept types get the stored columns as-is (see wire.py); JSON is
+    available for debugging.
+    """
+    version = _tiles_version()
+    buf = tiles.read(level, x, y, z)
+    if buf is None:
+        raise HTTPException(status_code=404, detail="no such node")
+    media = wire.negotiate(accept)
+
+    def build():
+        if media == wire.PACKED:
+            return Response(buf, media_type=media)
+        cols, _ = wire.unpack(buf)
+        if media == wire.ARROW:
+            return _binary(media, cols, {})
+        stars = [{"x": float(a), "y": float(b), "z": float(c), "mag": float(m)}
+                 for a, b, c, m in zip(cols["x"], cols["y"], cols["z"], cols["mag"])]
+        return _json({"count": len(stars), "stars": stars})
+    return _conditional(request, _etag(version, level, x, y, z, media), build)
+
+
+@app.post("/admin/refresh")
+def refresh(x_admin_token: Optional[str] = Header(None)):
+    """Reload the cached aggregates (after rerunning bq_jobs/) without a restart.
+    Disabled unless ADMIN_TOKEN is set."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="ADMIN_TOKEN not configured")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="bad admin token")
+    db.refresh_aggregates()
+    return {"status": "refreshed"}
 
 # Serve React Frontend (SPA)
 # Mount static files (JS, CSS, images)
@@ -88,3 +526,8 @@ if os.path.exists(static_dir):
             return FileResponse(file_path)
             
         return FileResponse(os.path.join(static_dir, "index.html"))
+
+
+_import_s = time.perf_counter() - _IMPORT_T0
+metrics.STARTUP.set(_import_s, phase="import")
+logger.info(f"api.main imported in {_import_s * 1000:.0f} ms")
@@ -0,0 +1,191 @@
+"""Prometheus metrics for the API, served as text by GET /metrics.
+
+Deliberately tiny (counters + histograms with labels, rendered in the text
+exposition format) so the API needs no client library.  Everything is
+thread-safe: the query pool records warehouse timings from worker threads.
+
+  galaxy_request_seconds{route,method,status}  request latency up to response start
+  galaxy_stage_seconds{stage}                  warehouse / fetch / local_read /
+                                               convert / serialize
+  galaxy_rows_returned_total{source}           rows pulled from bigquery / local / mock
+  galaxy_bigquery_jobs_total{status}
+  galaxy_bigquery_bytes_processed_total        from every job's total_bytes_processed
+  galaxy_bigquery_slot_seconds_total           from every job's slot_millis
+  galaxy_startup_seconds{phase}                import / bigquery_client / warm_up /
+                                               first_request (cold start)
+  galaxy_cache_*{cache}                        result caches + query coalescing, at scrape
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+INF_LABEL = 'le="+Inf"'
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterator[str]]] = []
+
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if v != float("inf") else "+Inf"
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_labels(self.labels, key)} {_fmt(v)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}     # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, v in items:
+            acc = 0
+            for le, n in zip(self.buckets, v):
+                acc += n
+                le_label = 'le="' + _fmt(le) + '"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le_label)} {acc}"
+            yield f"{self.name}_bucket{_labels(self.labels, key, INF_LABEL)} {v[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_fmt(v[-2])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {v[-1]}"
+
+
+def collector(fn: Callable[[], Iterator[str]]) -> Callable[[], Iterator[str]]:
+    """Register `fn` to emit extra exposition lines (e.g. cache stats) at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    for fn in _collectors:
+        lines.extend(fn())
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------------------------------------------------------- #
+REQUESTS = Histogram("galaxy_request_seconds", "HTTP request latency (to response start).",
+                     ("route", "method", "status"))
+STAGES = Histogram("galaxy_stage_seconds", "Time spent per request-handling stage.",
+                   ("stage",))
+ROWS = Counter("galaxy_rows_returned_total", "Rows fetched per data source.", ("source",))
+BQ_JOBS = Counter("galaxy_bigquery_jobs_total", "BigQuery jobs run.", ("status",))
+BQ_BYTES = Counter("galaxy_bigquery_bytes_processed_total",
+                   "total_bytes_processed reported by BigQuery jobs.")
+BQ_SLOTS = Counter("galaxy_bigquery_slot_seconds_total",
+                   "Slot time (slot_millis / 1000) reported by BigQuery jobs.")
+STARTUP = Gauge("galaxy_startup_seconds", "Cold-start phases of this worker.", ("phase",))
+
+
+def stage(name: str):
+    """`with stage("serialize"): ...` -> galaxy_stage_seconds{stage="serialize"}."""
+    return STAGES.time(stage=name)
+
+
+def record_job(job) -> None:
+    """Account a finished BigQuery job's bytes and slot time."""
+    BQ_JOBS.inc(status="done")
+    BQ_BYTES.inc(float(getattr(job, "total_bytes_processed", None) or 0))
+    BQ_SLOTS.inc(float(getattr(job, "slot_millis", None) or 0) / 1000.0)
+
+
+def cache_lines(stats: Dict[str, Dict[str, float]]) -> Iterator[str]:
+    """Exposition lines for /stats/cache-style {cache: {stat: value}} dicts."""
+    fields = {"hits": "counter", "misses": "counter", "evictions": "counter",
+              "hit_rate": "gauge", "entries": "gauge", "bytes": "gauge",
+              "executions": "counter", "shared": "counter", "share_rate": "gauge",
+              "in_flight": "gauge"}
+    for field, kind in fields.items():
+        rows = [(cache, s[field]) for cache, s in stats.items() if field in s]
+        if not rows:
+            continue
+        suffix = "_total" if kind == "counter" else ""
+        name = f"galaxy_cache_{field}{suffix}"
+        yield f"# TYPE {name} {kind}"
+        for cache, v in rows:
+            yield f'{name}{{cache="{cache}"}} {_fmt(v)}'
@@ -0,0 +1,117 @@
+"""Linear-octree spatial index for radius and k-nearest-neighbour star queries.
+
+Positions are quantised to 21 bits per axis over the bounding cube and sorted
+by Morton key, so every octree node is one contiguous slice of the sorted
+points, found by binary search on its key range.  Nodes are never stored: a
+query walks down from the root and only splits the nodes that are non-empty,
+cut by the ball, and hold more than POINTS_PER_CELL points.  Dense regions
+(the solar neighbourhood, the disc) are thereby split finer than empty ones,
+and a query costs about log(n) plus the points near the ball.  Pure NumPy, so
+building it for a 100k-star shell takes a few milliseconds.
+"""
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+POINTS_PER_CELL = 8                 # a node this small is scanned, not split
+_BITS = 21                          # per axis in the 63-bit Morton key
+_CHILD = np.array([[(i >> 2) & 1, (i >> 1) & 1, i & 1] for i in range(8)], dtype=np.int64)
+_CHILD_KEY = np.arange(8, dtype=np.uint64)    # child i's Morton digit, matching _CHILD
+
+
+def _spread(v: np.ndarray) -> np.ndarray:
+    """Move bit i of each 21-bit value to bit 3i."""
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF),
+                        (8, 0x100F00F00F00F00F), (4, 0x10C30C30C30C30C3),
+                        (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def _morton(c: np.ndarray) -> np.ndarray:
+    return (_spread(c[..., 0]) << np.uint64(2)) | (_spread(c[..., 1]) << np.uint64(1)) \
+        | _spread(c[..., 2])
+
+
+class OctreeIndex:
+    def __init__(self, pos: np.ndarray):
+        self.pos = np.asarray(pos, dtype=float).reshape(-1, 3)
+        n = len(self.pos)
+        lo, hi = (self.pos.min(0), self.pos.max(0)) if n else (np.zeros(3), np.ones(3))
+        self.origin = lo
+        self.side = max(float((hi - lo).max()), 1e-9)      # root cube edge
+        keys = _morton(self._quantise(self.pos))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.pos, self.order, self.keys))
+
+    def _quantise(self, p: np.ndarray) -> np.ndarray:
+        q = np.floor((p - self.origin) * (2**_BITS / self.side))
+        return np.clip(q, 0, 2**_BITS - 1).astype(np.int64)
+
+    def _slice(self, prefix: np.ndarray, level) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted-point [start, stop) of the nodes with these keys at `level`."""
+        shift = (3 * (_BITS - np.asarray(level))).astype(np.uint64)
+        first = prefix << shift
+        return (np.searchsorted(self.keys, first),
+                np.searchsorted(self.keys, first + (np.uint64(1) << shift)))
+
+    def _candidates(self, p: np.ndarray, r: float) -> np.ndarray:
+        coords = np.zeros((1, 3), dtype=np.int64)
+        prefix = np.zeros(1, dtype=np.uint64)
+        parts: List[np.ndarray] = []
+        for level in range(_BITS + 1):
+            a, b = self._slice(prefix, level)
+            size = self.side / 2**level
+            lo = self.origin + coords * size
+            near = np.maximum(np.maximum(lo - p, p - lo - size), 0.0)
+            far = np.maximum(np.abs(p - lo), np.abs(p - lo - size))
+            live = (b > a) & ((near ** 2).sum(1) <= r * r)
+            # Scan small nodes and nodes wholly inside the ball; split the rest.
+            done = live & ((b - a <= POINTS_PER_CELL) | ((far ** 2).sum(1) <= r * r)
+                           | (level == _BITS))
+            parts += [self.order[s:e] for s, e in zip(a[done], b[done])]
+            split = live & ~done
+            if not split.any():
+                break
+            coords = (coords[split, None, :] * 2 + _CHILD).reshape(-1, 3)
+            prefix = ((prefix[split, None] << np.uint64(3)) | _CHILD_KEY).reshape(-1)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def within(self, p, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, distances) of the points within `radius` of p, nearest first."""
+        p = np.asarray(p, dtype=float)
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        idx = self._candidates(p, radius)
+        d = np.linalg.norm(self.pos[idx] - p, axis=1)
+        keep = d <= radius
+        idx, d = idx[keep], d[keep]
+        order = np.argsort(d, kind="stable")
+        return idx[order], d[order]
+
+    def nearest(self, p, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, distances) of the k points nearest p, nearest first."""
+        p = np.asarray(p, dtype=float)
+        k = min(int(k), len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # The deepest node on p's path that still holds k points bounds the
+        # k-th distance: the k-th nearest of its points is at most that far.
+        levels = np.arange(_BITS + 1)
+        key = _morton(self._quantise(p)) >> (np.uint64(3) * (_BITS - levels).astype(np.uint64))
+        s, e = self._slice(key, levels)
+        deepest = np.flatnonzero(e - s >= k)[-1]      # counts shrink with depth
+        d = np.linalg.norm(self.pos[self.order[s[deepest]:e[deepest]]] - p, axis=1)
+        # (1 + 1e-9): don't lose the k-th point to rounding in the node bounds.
+        idx, d = self.within(p, float(np.partition(d, k - 1)[k - 1]) * (1 + 1e-9))
+        return idx[:k], d[:k]
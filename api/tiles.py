@@ -0,0 +1,63 @@
+"""Octree point-cloud tiles for level-of-detail rendering.
+
+Written offline by bq_jobs/build_tiles.py into TILES_DIR (default
+<GAIA_LOCAL_DIR>/tiles):
+
+  meta.json      half_size, depth, cap and {"L/x/y/z": n_points} for every node
+  L/x/y/z.gxc    x, y, z, mag float32 columns in wire.PACKED format
+
+The client reads meta.json once, then fetches only the nodes that are in view
+at the level of detail it wants.  Node files are served as stored; recently
+used ones stay in a byte-bounded LRU.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from . import local
+from .cache import ByteLRU
+
+DIR = os.getenv("TILES_DIR") or (os.path.join(local.ROOT, "tiles") if local.ROOT else "")
+EXT = ".gxc"
+TILE_CACHE_BYTES = int(float(os.getenv("TILE_CACHE_MB", "128")) * 2**20)
+tile_cache = ByteLRU("tiles", TILE_CACHE_BYTES)
+
+_meta: Optional[tuple[int, Dict[str, Any]]] = None   # (meta.json mtime_ns, parsed)
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(DIR) and (Path(DIR) / "meta.json").is_file()
+
+
+def meta() -> Dict[str, Any]:
+    """Parsed meta.json, reloaded (and the tile cache dropped) after a rebuild."""
+    global _meta
+    mtime = (Path(DIR) / "meta.json").stat().st_mtime_ns
+    if _meta is None or _meta[0] != mtime:
+        with _lock:
+            if _meta is None or _meta[0] != mtime:
+                tile_cache.clear()
+                _meta = (mtime, json.loads((Path(DIR) / "meta.json").read_text()))
+    return _meta[1]
+
+
+def version() -> str:
+    meta()
+    return f"tiles@{_meta[0]}"
+
+
+def read(level: int, x: int, y: int, z: int) -> Optional[bytes]:
+    """Packed bytes of node (level, x, y, z), or None if the octree has no such node."""
+    name = f"{level}/{x}/{y}/{z}"
+    if name not in meta()["nodes"]:
+        return None
+    buf = tile_cache.get(name)
+    if buf is None:
+        buf = (Path(DIR) / f"{name}{EXT}").read_bytes()
+        tile_cache.put(name, buf, len(buf))
+    return buf
@@ -0,0 +1,115 @@
+"""Binary columnar encodings for the point-cloud endpoints.
+
+JSON stays the default.  A client that sends one of these in `Accept` gets
+the same rows as flat little-endian columns it can wrap in typed arrays
+without parsing:
+
+  application/vnd.apache.arrow.stream   Arrow IPC stream, one record batch.
+                                        Extra JSON (e.g. paging info)
+                                        rides in the schema metadata key "meta".
+
+  application/x-galaxy-columns          the packed format below.
+
+Packed format (all integers little-endian uint32, every block 4-byte aligned):
+
+  offset  size        field
+  0       4           magic  b"GXC1"
+  4       4           n_rows
+  8       4           n_cols
+  12      16*n_cols   column descriptors: name (12 bytes ASCII, NUL-padded)
+                      + dtype (4 bytes ASCII, NUL-padded: "f4" or "i4")
+  ...     4*n_rows    column bodies, in descriptor order, back to back
+  ...     4           meta_len (0 if none)
+  ...     meta_len    UTF-8 JSON metadata
+
+In the browser: `new Float32Array(buf, 12 + 16 * nCols + i * 4 * nRows, nRows)`.
+"""
+from __future__ import annotations
+
+import json
+import struct
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pyarrow as pa
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+PACKED = "application/x-galaxy-columns"
+MAGIC = b"GXC1"
+
+_DTYPES = {"f4": np.dtype("<f4"), "i4": np.dtype("<i4")}
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick JSON / ARROW / PACKED from an Accept header (highest q wins, JSON on ties)."""
+    best, best_q = JSON, 0.0
+    for part in (accept or "").split(","):
+        media, *opts = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for o in opts:
+            if o.startswith("q="):
+                try:
+                    q = float(o[2:])
+                except ValueError:
+                    q = 0.0
+        if media in (ARROW, PACKED) and q > best_q:
+            best, best_q = media, q
+        elif media in (JSON, "*/*", "application/*") and q >= best_q:
+            best, best_q = JSON, q
+    return best
+
+
+def _column(values, code: str) -> np.ndarray:
+    return np.ascontiguousarray(values, dtype=_DTYPES[code])
+
+
+def pack(columns: Dict[str, Any], dtypes: Dict[str, str],
+         meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """Encode equal-length columns in the packed format.  dtypes: name -> "f4" | "i4"."""
+    n = len(next(iter(columns.values()))) if columns else 0
+    head = [MAGIC, struct.pack("<II", n, len(columns))]
+    body = []
+    for name, values in columns.items():
+        code = dtypes.get(name, "f4")
+        head.append(struct.pack("<12s4s", name.encode("ascii"), code.encode("ascii")))
+        body.append(_column(values, code).tobytes())
+    extra = json.dumps(meta, separators=(",", ":")).encode() if meta else b""
+    extra += b" " * (-len(extra) % 4)
+    return b"".join(head + body + [struct.pack("<I", len(extra)), extra])
+
+
+def unpack(buf: bytes) -> tuple[Dict[str, np.ndarray], Optional[Dict[str, Any]]]:
+    """Inverse of pack (used by tests / Python clients)."""
+    if buf[:4] != MAGIC:
+        raise ValueError("not a packed column buffer")
+    n, ncols = struct.unpack_from("<II", buf, 4)
+    off, descs = 12, []
+    for _ in range(ncols):
+        name, code = struct.unpack_from("<12s4s", buf, off)
+        descs.append((name.rstrip(b"\0").decode(), code.rstrip(b"\0").decode()))
+        off += 16
+    cols = {}
+    for name, code in descs:
+        cols[name] = np.frombuffer(buf, dtype=_DTYPES[code], count=n, offset=off)
+        off += 4 * n
+    (mlen,) = struct.unpack_from("<I", buf, off)
+    meta = json.loads(buf[off + 4:off + 4 + mlen]) if mlen else None
+    return cols, meta
+
+
+def arrow(columns: Dict[str, Any], dtypes: Dict[str, str],
+          meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """Encode equal-length columns as an Arrow IPC stream (single record batch)."""
+    arrays = {name: pa.array(_column(v, dtypes.get(name, "f4"))) for name, v in columns.items()}
+    schema_meta = {"meta": json.dumps(meta, separators=(",", ":"))} if meta else None
+    batch = pa.RecordBatch.from_pydict(arrays, metadata=schema_meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as w:
+        w.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(media: str, columns: Dict[str, Any], dtypes: Dict[str, str],
+           meta: Optional[Dict[str, Any]] = None) -> bytes:
+    return (arrow if media == ARROW else pack)(columns, dtypes, meta)
@@ -10,7 +10,7 @@ Overlays:   HYG database (names), d3-celestial (constellation lines, Milky Way).
 """
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
@@ -50,7 +50,9 @@ def _warm_astropy() -> bool:
     return True
 
 
-@st.cache_data(show_spinner="Loading star catalogue & sky overlays…")
+# cache_resource, not cache_data: one shared catalogue instead of a copy per
+# rerun, so its precomputed unit vectors (and proper-motion epoch) persist.
+@st.cache_resource(show_spinner="Loading star catalogue & sky overlays…")
 def load_everything():
     cat = catalog.load_catalog(
         STARS / "visible_stars_with_hipparcos_and_names.parquet",
@@ -171,7 +173,31 @@ def sidebar():
         show_grid=st.sidebar.checkbox("Alt/Az grid", True),
         show_ground=True,
     )
-    return local_dt, lat, lon, mag_limit, projection, opts, playing
+    return local_dt, lat, lon, mag_limit, projection, opts, playing, speed
+
+
+# --------------------------------------------------------------------------- #
+# Play mode: the whole day's frames in one batch
+# --------------------------------------------------------------------------- #
+def play_frame(cat, local_dt, lat, lon, dt_years, mag_limit, speed):
+    """Scene for the current play tick.  Play advances the time of day by a
+    fixed step per tick, so every frame of the loop is known in advance: they
+    are computed together (render.compute_scenes) and kept in the session
+    until the day, place, magnitude limit or speed changes."""
+    step = speed * 0.2
+    tod = st.session_state.tod
+    phase = round(tod % step, 6) % step     # tod drifts by float error each tick
+    key = (local_dt.date(), str(local_dt.tzinfo), lat, lon, mag_limit, step, phase)
+    if st.session_state.get("_frames_key") != key:
+        day = datetime(local_dt.year, local_dt.month, local_dt.day, tzinfo=local_dt.tzinfo)
+        times = [(day + timedelta(hours=phase + step * k)).astimezone(ZoneInfo("UTC"))
+                 for k in range(round(24 / step))]
+        with st.spinner("Computing the time-lapse…"):
+            st.session_state._frames = render.compute_scenes(cat, times, lat, lon,
+                                                             dt_years, mag_limit)
+        st.session_state._frames_key = key
+    frames = st.session_state._frames
+    return frames.frame(round((tod - phase) / step) % len(frames))
 
 
 # --------------------------------------------------------------------------- #
@@ -179,12 +205,15 @@ def sidebar():
 # --------------------------------------------------------------------------- #
 def main():
     cat, lines, labels, mw = load_everything()
-    local_dt, lat, lon, mag_limit, projection, opts, playing = sidebar()
+    local_dt, lat, lon, mag_limit, projection, opts, playing, speed = sidebar()
 
     utc_dt = local_dt.astimezone(ZoneInfo("UTC"))
     dt_years = Time(utc_dt.replace(tzinfo=None)).jyear - 2016.0
 
-    scene = render.compute_scene(cat, utc_dt, lat, lon, dt_years, mag_limit)
+    if playing and st_autorefresh is not None:
+        scene = play_frame(cat, local_dt, lat, lon, dt_years, mag_limit, speed)
+    else:
+        scene = render.compute_scene(cat, utc_dt, lat, lon, dt_years, mag_limit)
     fig = render.render_sky(cat, scene, projection=projection,
                             lines=lines, labels=labels, milkyway=mw, **opts)
 
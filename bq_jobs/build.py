@@ -7,18 +7,25 @@ query full-scans 77 GB. These jobs fix that and precompute the small aggregate
 tables the API serves:
 
   materialize  -> gaia_ly.stars_native   (native, CLUSTERED by healpix_2,
-                                           distance_bin; slimmed columns)
+                                           distance_bin, sample_tier; slimmed
+                                           columns)
   density      -> gaia_ly.density_voxels  (healpix x distance-shell counts)
-  hr           -> gaia_ly.hr_bins         (BP-RP x absolute-mag histogram)
+  pyramid      -> gaia_ly.density_pyramid (density_voxels at coarser levels of
+                                           detail; reads only density_voxels)
+  hr           -> gaia_ly.hr_bins         (BP-RP x absolute-mag histogram per
+                                           healpix_2 x distance_bin)
 
 Every job supports a FREE dry run that prints bytes scanned + a cost estimate
 before you spend anything.  Clustering is a separate script (clustering.py).
 
 Usage:
-  python bq_jobs/build.py --job all       --dry-run     # estimate cost (free)
-  python bq_jobs/build.py --job materialize --run        # ~77 GB one-time scan
-  python bq_jobs/build.py --job density --run            # cheap on stars_native
-  python bq_jobs/build.py --job hr --run                 # cheap on stars_native
+  python -m bq_jobs.build --job all       --dry-run     # estimate cost (free)
+  python -m bq_jobs.build --job materialize --run        # ~77 GB one-time scan
+  python -m bq_jobs.build --job density --run            # cheap on stars_native
+  python -m bq_jobs.build --job pyramid --run            # tiny, off density_voxels
+  python -m bq_jobs.build --job hr --run                 # cheap on stars_native
+
+(from the repository root, so the shared sampling.py is importable).
 """
 from __future__ import annotations
 
@@ -30,6 +37,8 @@ from pathlib import Path
 from dotenv import load_dotenv
 from google.cloud import bigquery
 
+from sampling import sample_tier_sql
+
 load_dotenv(Path(__file__).resolve().parent.parent / "api" / ".env")
 
 PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT", "aicouncelling")
@@ -37,24 +46,41 @@ DATASET = os.getenv("BIGQUERY_DATASET", "gaia_ly")
 SOURCE = os.getenv("BIGQUERY_TABLE", f"{PROJECT}.{DATASET}.stars")   # external 77 GB
 NATIVE = f"{PROJECT}.{DATASET}.stars_native"
 DENSITY = f"{PROJECT}.{DATASET}.density_voxels"
+PYRAMID = f"{PROJECT}.{DATASET}.density_pyramid"
 HR = f"{PROJECT}.{DATASET}.hr_bins"
 
 PRICE_PER_TB = 5.0          # USD, BigQuery on-demand
 PC_PER_LY = 1.0 / 3.26156   # ly -> parsec
 SENTINEL_LY = 9999          # low-parallax rows were parked at distance_ly = 10000
+# Density levels of detail: lod -> (healpix level, shell width ly).  lod 0 is
+# density_voxels; the API picks a level so /density stays a few thousand voxels.
+DENSITY_LODS = [(2, 50), (2, 100), (1, 500), (0, 1000)]
+_LOD_ROWS = ", ".join(f"STRUCT({i} AS lod, {lvl} AS hp_level, {w} AS shell)"
+                      for i, (lvl, w) in enumerate(DENSITY_LODS) if i)
+
+
+def _wavg(col: str) -> str:
+    """n-weighted mean of a per-voxel mean, ignoring voxels where it is NULL."""
+    return f"SAFE_DIVIDE(SUM(v.n * v.{col}), SUM(IF(v.{col} IS NULL, 0, v.n)))"
+
 
 # --------------------------------------------------------------------------- #
 # SQL
 # --------------------------------------------------------------------------- #
 SQL = {
     # One-time: native, clustered, slimmed copy of the external table.
+    # sample_tier lets the API take "sample_tier < k" as an unbiased sample
+    # instead of whatever LIMIT reads first.  It does not cut the bytes scanned:
+    # a (healpix_2, distance_bin) cell is far below a storage block, so each
+    # block spans nearly every tier and clustering can't prune on it.
     "materialize": f"""
         CREATE OR REPLACE TABLE `{NATIVE}`
-        CLUSTER BY healpix_2, distance_bin AS
+        CLUSTER BY healpix_2, distance_bin, sample_tier AS
         SELECT
             source_id, healpix_2, distance_bin, distance_ly,
             x, y, z, vx, vy, vz,
-            phot_g_mean_mag, bp_rp, has_rvs
+            phot_g_mean_mag, bp_rp, has_rvs,
+            {sample_tier_sql("source_id")} AS sample_tier
         FROM `{SOURCE}`
         WHERE distance_ly > 0
     """,
@@ -76,11 +102,35 @@ SQL = {
         GROUP BY healpix_2, distance_bin
     """,
 
-    # Hertzsprung-Russell / colour-magnitude histogram.
+    # Coarser density levels, merged from density_voxels: the nested healpix
+    # parent at level l is healpix_2 >> 2 * (2 - l); shells merge by width.
+    "pyramid": f"""
+        CREATE OR REPLACE TABLE `{PYRAMID}`
+        CLUSTER BY lod AS
+        SELECT
+            l.lod,
+            v.healpix_2 >> (2 * (2 - l.hp_level))          AS healpix,
+            DIV(v.distance_bin, l.shell) * l.shell          AS distance_bin,
+            SUM(v.n)                                        AS n,
+            {_wavg("mean_g")}  AS mean_g,
+            {_wavg("mean_bp_rp")}  AS mean_bp_rp,
+            {_wavg("cx")}  AS cx,
+            {_wavg("cy")}  AS cy,
+            {_wavg("cz")}  AS cz
+        FROM `{DENSITY}` AS v
+        CROSS JOIN UNNEST([{_LOD_ROWS}]) AS l
+        GROUP BY lod, healpix, distance_bin
+    """,
+
+    # Hertzsprung-Russell / colour-magnitude cube: one histogram per
+    # (healpix sector, distance shell), so the API can sum any sector / range.
     "hr": f"""
-        CREATE OR REPLACE TABLE `{HR}` AS
+        CREATE OR REPLACE TABLE `{HR}`
+        CLUSTER BY healpix_2, distance_bin AS
         WITH s AS (
             SELECT
+                healpix_2,
+                distance_bin,
                 bp_rp,
                 phot_g_mean_mag - 5 * LOG10(distance_ly * {PC_PER_LY}) + 5 AS absmag,
                 distance_ly
@@ -90,22 +140,26 @@ SQL = {
               AND bp_rp BETWEEN -0.6 AND 4.5
         )
         SELECT
+            healpix_2,
+            distance_bin,
             ROUND(bp_rp / 0.05) * 0.05  AS bp_rp_bin,
             ROUND(absmag / 0.2) * 0.2   AS absmag_bin,
             COUNT(*)                    AS n
         FROM s
         WHERE absmag BETWEEN -6 AND 20
-        GROUP BY bp_rp_bin, absmag_bin
+        GROUP BY healpix_2, distance_bin, bp_rp_bin, absmag_bin
     """,
 }
 
 
-JOB_DEST = {"materialize": NATIVE, "density": DENSITY, "hr": HR}
+JOB_DEST = {"materialize": NATIVE, "density": DENSITY, "pyramid": PYRAMID, "hr": HR}
 
 
 def _job_source(job: str, use_native: bool) -> str:
     if job == "materialize":
         return SOURCE                       # always reads the external 77 GB table
+    if job == "pyramid":
+        return DENSITY
     return NATIVE if use_native else SOURCE
 
 
@@ -147,7 +201,7 @@ def run_job(client: bigquery.Client, job: str, use_native: bool, do_run: bool) -
 
 def main() -> int:
     ap = argparse.ArgumentParser(description=__doc__)
-    ap.add_argument("--job", choices=["materialize", "density", "hr", "all"], default="all")
+    ap.add_argument("--job", choices=[*SQL, "all"], default="all")
     ap.add_argument("--run", action="store_true", help="actually execute (costs money)")
     ap.add_argument("--dry-run", action="store_true", help="estimate cost only (free)")
     ap.add_argument("--external", action="store_true",
@@ -159,7 +213,7 @@ def main() -> int:
     client = bigquery.Client(project=PROJECT)
     use_native = not args.external
 
-    jobs = ["materialize", "density", "hr"] if args.job == "all" else [args.job]
+    jobs = list(SQL) if args.job == "all" else [args.job]
     if args.external and "materialize" in jobs:
         jobs.remove("materialize")
 
@@ -171,7 +225,7 @@ def main() -> int:
         # density/hr read the native table, which only exists after materialize
         run_job(client, job, use_native=use_native, do_run=do_run)
     if not do_run:
-        print("\nRe-run with --run to execute. Order: materialize → density → hr,"
+        print("\nRe-run with --run to execute. Order: materialize → density → pyramid → hr,"
               " then `python bq_jobs/clustering.py`.")
     return 0
 
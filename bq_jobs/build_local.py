@@ -0,0 +1,107 @@
+"""
+Local equivalent of build.py: precompute the aggregate tables the API serves
+straight from the `gaia_ly` Parquet tree, for the on-prem / offline backend
+(api/local.py, enabled with GAIA_LOCAL_DIR).
+
+  density  -> <root>/density_voxels.parquet  (healpix x distance-shell counts)
+  pyramid  -> <root>/density_pyramid.parquet (coarser levels, from density_voxels)
+  hr       -> <root>/hr_bins.parquet         (BP-RP x absolute-mag histogram per
+                                              healpix_2 x distance_bin)
+
+Same definitions as the SQL in build.py, evaluated with a streaming polars scan
+so the full tree never has to fit in memory.  For the cluster tables run
+`python bq_jobs/clustering.py --run --local-out <root>`.
+
+Usage:
+  python bq_jobs/build_local.py --root /data/gaia_ly --job all
+  python bq_jobs/build_local.py --root /data/gaia_ly --job density
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import polars as pl
+
+PC_PER_LY = 1.0 / 3.26156   # ly -> parsec
+SENTINEL_LY = 9999          # low-parallax rows were parked at distance_ly = 10000
+DENSITY_LODS = [(2, 50), (2, 100), (1, 500), (0, 1000)]   # as in build.py
+
+
+def _scan(root: Path) -> pl.LazyFrame:
+    return pl.scan_parquet(str(root / "bin_*" / "*.parquet"))
+
+
+def density(src: pl.LazyFrame) -> pl.LazyFrame:
+    d = pl.col("distance_ly")
+    return (src.filter(d < SENTINEL_LY)
+            .group_by("healpix_2", "distance_bin")
+            .agg(pl.len().alias("n"),
+                 pl.col("phot_g_mean_mag").mean().alias("mean_g"),
+                 pl.col("bp_rp").mean().alias("mean_bp_rp"),
+                 (pl.col("x") * d).mean().alias("cx"),
+                 (pl.col("y") * d).mean().alias("cy"),
+                 (pl.col("z") * d).mean().alias("cz")))
+
+
+def pyramid(voxels: pl.LazyFrame) -> pl.LazyFrame:
+    n = pl.col("n")
+
+    def wavg(c: str) -> pl.Expr:
+        return (n * pl.col(c)).sum() / n.filter(pl.col(c).is_not_null()).sum()
+
+    return pl.concat([
+        voxels.group_by(pl.lit(lod, pl.Int32).alias("lod"),
+                        (pl.col("healpix_2") // 4 ** (2 - level)).alias("healpix"),
+                        (pl.col("distance_bin") // shell * shell).alias("distance_bin"))
+        .agg(n.sum(), *(wavg(c).alias(c) for c in ("mean_g", "mean_bp_rp", "cx", "cy", "cz")))
+        for lod, (level, shell) in enumerate(DENSITY_LODS) if lod])
+
+
+def hr(src: pl.LazyFrame) -> pl.LazyFrame:
+    d = pl.col("distance_ly")
+    absmag = pl.col("phot_g_mean_mag") - 5 * (d * PC_PER_LY).log10() + 5
+    return (src.filter(pl.col("bp_rp").is_not_null() & (d > 0) & (d < SENTINEL_LY)
+                       & pl.col("bp_rp").is_between(-0.6, 4.5))
+            .select("healpix_2", "distance_bin", pl.col("bp_rp"), absmag.alias("absmag"))
+            .filter(pl.col("absmag").is_between(-6, 20))
+            .group_by("healpix_2", "distance_bin",
+                      (pl.col("bp_rp") / 0.05).round() * 0.05,
+                      (pl.col("absmag") / 0.2).round() * 0.2)
+            .agg(pl.len().alias("n"))
+            .rename({"bp_rp": "bp_rp_bin", "absmag": "absmag_bin"}))
+
+
+# job -> (output name, build, input: None for the star tree, else an aggregate)
+JOBS = {"density": ("density_voxels", density, None),
+        "pyramid": ("density_pyramid", pyramid, "density_voxels"),
+        "hr": ("hr_bins", hr, None)}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--root", default=os.getenv("GAIA_LOCAL_DIR", ""),
+                    help="gaia_ly tree (bin_*/…parquet); default $GAIA_LOCAL_DIR")
+    ap.add_argument("--job", choices=[*JOBS, "all"], default="all")
+    args = ap.parse_args()
+    root = Path(args.root)
+    if not args.root or not root.is_dir():
+        print("--root (or GAIA_LOCAL_DIR) must point at the gaia_ly directory.")
+        return 1
+
+    for job in (list(JOBS) if args.job == "all" else [args.job]):
+        name, build, src = JOBS[job]
+        t0 = time.perf_counter()
+        lf = pl.scan_parquet(root / f"{src}.parquet") if src else _scan(root)
+        out = build(lf).collect(engine="streaming")
+        out.write_parquet(root / f"{name}.parquet")
+        print(f"{job}: wrote {out.height:,} rows to {name}.parquet "
+              f"in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Octree tiler for level-of-detail point clouds (served by GET /tiles/...).
+
+Builds a Potree-style octree of star positions (x, y, z in ly, Sun at the
+origin) from the `gaia_ly` Parquet tree.  The root cube spans +-HALF_SIZE ly;
+every node keeps the CAP brightest stars that no ancestor kept and hands the
+rest down to its 8 children, so the coarse levels are the brightest stars of
+the whole sky and each level adds detail where stars are dense.  Nodes at
+--depth keep everything that reaches them.
+
+  <out>/meta.json          half_size, depth, cap + {"L/x/y/z": n_points} per node
+  <out>/L/x/y/z.gxc        one node: x, y, z, mag float32 columns in the
+                           packed format of api/wire.py
+
+Node (L, x, y, z) covers [-H + x*s, -H + (x+1)*s) on each axis, s = 2H / 2**L.
+
+Out of core: one streaming pass buckets the stars into shard files, one per
+node at --shard-level.  It also keeps the brightest --shard-level * CAP stars
+of each shard, because those are the only ones the levels above the shards can
+hold.  Then the upper levels are built from those candidates and each shard's
+subtree is built in memory on its own.  Peak memory is about the largest
+shard; raise --shard-level if that does not fit.
+
+Usage:
+  python bq_jobs/build_tiles.py --root /data/gaia_ly                 # -> <root>/tiles
+  python bq_jobs/build_tiles.py --root /data/gaia_ly --cap 20000 --depth 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from api import wire  # noqa: E402
+
+HALF_SIZE = 17000.0         # ly; the API's max distance
+SENTINEL_LY = 9999          # low-parallax rows were parked at distance_ly = 10000
+EXT = ".gxc"
+
+_REC = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("mag", "<f4"), ("sid", "<i8")])
+
+
+def _cells(rec: np.ndarray, level: int, half: float) -> np.ndarray:
+    """(N, 3) integer cell coordinates of each record at `level`."""
+    n = 1 << level
+    xyz = np.stack([rec["x"], rec["y"], rec["z"]], axis=1).astype(np.float64)
+    return np.clip(((xyz + half) * (n / (2 * half))).astype(np.int64), 0, n - 1)
+
+
+def _key(cells: np.ndarray, level: int) -> np.ndarray:
+    return (cells[:, 0] << (2 * level)) | (cells[:, 1] << level) | cells[:, 2]
+
+
+def _brightest_first(rec: np.ndarray) -> np.ndarray:
+    # Ties broken by source_id so every pass agrees on the order.
+    return rec[np.lexsort((rec["sid"], rec["mag"]))]
+
+
+def _read(path: Path) -> np.ndarray:
+    t = pq.read_table(path, columns=["source_id", "x", "y", "z", "distance_ly",
+                                     "phot_g_mean_mag"])
+    d = t["distance_ly"].to_numpy(zero_copy_only=False)
+    mag = t["phot_g_mean_mag"].to_numpy(zero_copy_only=False)
+    keep = (d < SENTINEL_LY) & np.isfinite(mag)
+    rec = np.empty(int(keep.sum()), dtype=_REC)
+    for c in ("x", "y", "z"):
+        rec[c] = t[c].to_numpy(zero_copy_only=False)[keep] * d[keep]
+    rec["mag"], rec["sid"] = mag[keep], t["source_id"].to_numpy()[keep]
+    return rec
+
+
+class Tiler:
+    def __init__(self, out: Path, cap: int, depth: int, half: float):
+        self.out, self.cap, self.depth, self.half = out, cap, depth, half
+        self.nodes: dict[str, int] = {}
+
+    def write(self, level: int, cell: tuple[int, int, int], rec: np.ndarray) -> None:
+        name = f"{level}/{cell[0]}/{cell[1]}/{cell[2]}"
+        path = self.out / f"{name}{EXT}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(wire.pack({c: rec[c] for c in ("x", "y", "z", "mag")}, {}))
+        self.nodes[name] = len(rec)
+
+    def build(self, level: int, cell: tuple[int, int, int], rec: np.ndarray,
+              stop: int | None = None, leftover: dict | None = None) -> None:
+        """Write the subtree of `cell` from brightest-first `rec`.
+
+        With `stop`, nodes at that level are not written; what reaches them is
+        counted into `leftover[(x, y, z)]` instead.
+        """
+        if len(rec) == 0:
+            return
+        if level == stop:
+            leftover[cell] = leftover.get(cell, 0) + len(rec)
+            return
+        if level == self.depth or len(rec) <= self.cap:
+            self.write(level, cell, rec)
+            return
+        self.write(level, cell, rec[:self.cap])
+        rest = rec[self.cap:]
+        child = _cells(rest, level + 1, self.half)
+        key = _key(child & 1, 1)
+        order = np.argsort(key, kind="stable")        # stable: stays brightest-first
+        bounds = np.searchsorted(key[order], np.arange(9))
+        for k in range(8):
+            part = rest[order[bounds[k]:bounds[k + 1]]]
+            if len(part):
+                c = tuple(int(v) for v in child[order[bounds[k]]])
+                self.build(level + 1, c, part, stop, leftover)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--root", default=os.getenv("GAIA_LOCAL_DIR", ""),
+                    help="gaia_ly tree (bin_*/…parquet); default $GAIA_LOCAL_DIR")
+    ap.add_argument("--out", default="", help="tile directory (default <root>/tiles)")
+    ap.add_argument("--cap", type=int, default=20000, help="points per node")
+    ap.add_argument("--depth", type=int, default=12, help="deepest level")
+    ap.add_argument("--shard-level", type=int, default=4)
+    ap.add_argument("--spill-mb", type=int, default=1024,
+                    help="buffer this much before appending to shard files")
+    args = ap.parse_args()
+    root = Path(args.root)
+    if not args.root or not root.is_dir():
+        print("--root (or GAIA_LOCAL_DIR) must point at the gaia_ly directory.")
+        return 1
+    out = Path(args.out) if args.out else root / "tiles"
+    if out.exists():
+        if any(out.iterdir()) and not (out / "meta.json").exists():
+            print(f"{out} exists and is not a tile directory; pick another --out.")
+            return 1
+        shutil.rmtree(out)
+    spill = out / "_shards"
+    spill.mkdir(parents=True)
+    S = min(args.shard_level, args.depth)
+    keep = S * args.cap
+    tiler = Tiler(out, args.cap, args.depth, HALF_SIZE)
+
+    # Pass 1: bucket into shards; remember each shard's brightest `keep` stars.
+    t0 = time.perf_counter()
+    top: dict[int, np.ndarray] = {}
+    buf: dict[int, list] = {}
+    buffered = total = 0
+
+    def flush():
+        for k, parts in buf.items():
+            with open(spill / f"{k}.bin", "ab") as f:
+                for p in parts:
+                    p.tofile(f)
+        buf.clear()
+
+    files = sorted(root.glob("bin_*/*.parquet"))
+    for i, path in enumerate(files, 1):
+        rec = _read(path)
+        if not len(rec):
+            continue
+        total += len(rec)
+        shard = _key(_cells(rec, S, HALF_SIZE), S)
+        order = np.argsort(shard, kind="stable")
+        shard, rec = shard[order], rec[order]
+        starts = np.flatnonzero(np.r_[True, shard[1:] != shard[:-1]])
+        for a, b in zip(starts, np.r_[starts[1:], len(rec)]):
+            k, part = int(shard[a]), rec[a:b]
+            buf.setdefault(k, []).append(part)
+            merged = part if k not in top else np.concatenate([top[k], part])
+            top[k] = _brightest_first(merged)[:keep]
+        buffered += rec.nbytes
+        if buffered > args.spill_mb * 2**20:
+            flush()
+            buffered = 0
+        if i % 200 == 0:
+            print(f"  scanned {i}/{len(files)} files, {total:,} stars")
+    flush()
+    print(f"pass 1: {total:,} stars into {len(top):,} shards "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+    # Levels above the shards, from the candidates alone.
+    t0 = time.perf_counter()
+    upper: dict[tuple, int] = {}
+    candidates = _brightest_first(np.concatenate(list(top.values()))) if top else \
+        np.empty(0, dtype=_REC)
+    tiler.build(0, (0, 0, 0), candidates, stop=S, leftover=upper)
+    taken = {}
+    for k, arr in top.items():
+        cell = tuple(int(v) for v in _cells(arr[:1], S, HALF_SIZE)[0])
+        taken[k] = len(arr) - upper.get(cell, 0)   # stars kept above level S
+    print(f"levels 0-{S - 1}: {len(tiler.nodes):,} nodes in {time.perf_counter() - t0:.1f}s")
+
+    # Pass 2: each shard's subtree.
+    t0 = time.perf_counter()
+    for k in sorted(top):
+        rec = _brightest_first(np.fromfile(spill / f"{k}.bin", dtype=_REC))[taken[k]:]
+        if len(rec):
+            cell = tuple(int(v) for v in _cells(rec[:1], S, HALF_SIZE)[0])
+            tiler.build(S, cell, rec)
+        (spill / f"{k}.bin").unlink()
+    spill.rmdir()
+    print(f"levels {S}+: {len(tiler.nodes):,} nodes total in {time.perf_counter() - t0:.1f}s")
+
+    meta = {"half_size": HALF_SIZE, "depth": args.depth, "cap": args.cap,
+            "points": sum(tiler.nodes.values()), "nodes": tiler.nodes}
+    (out / "meta.json").write_text(json.dumps(meta, separators=(",", ":")))
+    print(f"wrote {meta['points']:,} points in {len(tiler.nodes):,} nodes to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,7 @@ Outputs two native tables (run in YOUR GCP project; the SELECT scans data):
 Usage:
   python bq_jobs/clustering.py --dry-run                 # count stars + cost note
   python bq_jobs/clustering.py --run --max-dist 600      # cluster & write back
+  python bq_jobs/clustering.py --run --local-out /data/gaia_ly   # + Parquet for api/local.py
 """
 from __future__ import annotations
 
@@ -81,6 +82,9 @@ def main() -> int:
     ap.add_argument("--sample-cap", type=int, default=0,
                     help="cap stars pulled (0 = all in volume)")
     ap.add_argument("--external", action="store_true", help="read external table")
+    ap.add_argument("--local-out", default="",
+                    help="also write cluster_stars/cluster_catalog Parquet here "
+                         "(the GAIA_LOCAL_DIR served by api/local.py)")
     ap.add_argument("--run", action="store_true")
     ap.add_argument("--dry-run", action="store_true")
     args = ap.parse_args()
@@ -164,10 +168,19 @@ def main() -> int:
     print(catalog.head(20).to_string(index=False))
 
     members = df[df.cluster_id >= 0][["source_id", "X", "Y", "Z", "mag", "bp_rp", "cluster_id"]]
+    # The API pages members per cluster in source_id order (/clusters/{id}/members).
+    members = members.sort_values(["cluster_id", "source_id"])
     job = bigquery.LoadJobConfig(write_disposition="WRITE_TRUNCATE")
-    client.load_table_from_dataframe(members, f"{PROJECT}.{DATASET}.cluster_stars", job_config=job).result()
+    member_job = bigquery.LoadJobConfig(write_disposition="WRITE_TRUNCATE",
+                                        clustering_fields=["cluster_id"])
+    client.load_table_from_dataframe(members, f"{PROJECT}.{DATASET}.cluster_stars", job_config=member_job).result()
     client.load_table_from_dataframe(catalog, f"{PROJECT}.{DATASET}.cluster_catalog", job_config=job).result()
     print(f"Wrote {len(members):,} members + {len(catalog)} clusters to BigQuery.")
+    if args.local_out:
+        out = Path(args.local_out)
+        members.to_parquet(out / "cluster_stars.parquet", index=False)
+        catalog.to_parquet(out / "cluster_catalog.parquet", index=False)
+        print(f"Wrote cluster_stars/cluster_catalog Parquet to {out}.")
     return 0
 
 
@@ -2,6 +2,8 @@ import polars as pl
 import numpy as np
 from pathlib import Path
 
+from sampling import sample_tier, tier_band  # shared with the API and BigQuery jobs; run from the repo root
+
 # Input/output paths
 input_dir = Path('/Volumes/One Touch/bigdata/data/gaia_partitioned')
 output_dir = Path('/Volumes/One Touch/bigdata/data/gaia_ly')
@@ -50,6 +52,7 @@ def compute_columns(df: pl.DataFrame) -> pl.DataFrame:
         pl.Series("vy", vy),
         pl.Series("vz", vz),
         pl.Series("distance_bin", bins),
+        pl.Series("sample_tier", sample_tier(df["source_id"].to_numpy())),
     ])
 
 # Start processing
@@ -72,7 +75,12 @@ for parquet_path in input_dir.glob("*.parquet"):
         bin_dir.mkdir(exist_ok=True)
 
         out_path = bin_dir / f"{parquet_path.stem}_bin_{int(bin_val)}.parquet"
-        group_df.write_parquet(out_path)
+        # Sorted by tier band, then sector: row-group min/max stats let readers
+        # skip by sector, and a sampled read (sample_tier < k) stops after the
+        # bands below k instead of decoding the whole file.
+        band = pl.Series("tier_band", tier_band(group_df["sample_tier"].to_numpy()))
+        (group_df.with_columns(band).sort("tier_band", "healpix_2", "sample_tier")
+         .drop("tier_band").write_parquet(out_path, row_group_size=65536))
 
     print(f"✅ Finished: {parquet_path.name}")
 
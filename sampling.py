@@ -0,0 +1,46 @@
+"""sample_tier: the per-star sampling hash shared by every Galaxy Explorer backend.
+
+Each star gets `sample_tier` in [0, SAMPLE_TIERS), a hash of its source_id, so
+`sample_tier < k` is a uniform k / SAMPLE_TIERS sample of any range.  The API
+(api/db.py, api/local.py), the BigQuery materialize job (bq_jobs/build.py) and
+the Parquet partitioner (pyspark_code/ly_partitioning.py) all import it from
+here, so a star lands in the same tier in the warehouse and on local disk.
+
+The hash is two multiply-mod-prime + xorshift rounds with every intermediate
+below 2**62, i.e. plain INT64 arithmetic that BigQuery evaluates exactly.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+SAMPLE_TIERS = 1024
+TIER_PRIME = 2_147_483_647
+TIER_ROUNDS = ((1_103_515_245, 16), (1_812_433_253, 13))   # (multiplier, xorshift)
+
+
+def sample_tier(source_id: np.ndarray) -> np.ndarray:
+    """Tier of each source_id: uniform, and uncorrelated with the sky position
+    held in the id's top bits."""
+    h = np.asarray(source_id, dtype=np.int64) % TIER_PRIME
+    for mult, shift in TIER_ROUNDS:
+        h = (h * mult) % TIER_PRIME
+        h ^= h >> shift
+    return (h % SAMPLE_TIERS).astype(np.int32)
+
+
+def sample_tier_sql(col: str) -> str:
+    """BigQuery SQL computing sample_tier() of the INT64 column `col`."""
+    h = f"MOD({col}, {TIER_PRIME})"
+    for mult, shift in TIER_ROUNDS:
+        h = f"MOD({h} * {mult}, {TIER_PRIME})"
+        h = f"({h} ^ ({h} >> {shift}))"
+    return f"MOD({h}, {SAMPLE_TIERS})"
+
+
+def tier_band(tier: np.ndarray) -> np.ndarray:
+    """Doubling band of each tier: 0 -> 0, 1 -> 1, 2-3 -> 2, 4-7 -> 3, ...
+
+    Files sorted by band first keep low tiers in row groups of their own, so a
+    `sample_tier < k` read skips every band above k and reads under 2k tiers.
+    """
+    return np.frexp(np.asarray(tier, dtype=np.float64))[1].astype(np.int32)
@@ -8,13 +8,18 @@ lines, constellation label points and the Milky-Way outline (GeoJSON).
 from __future__ import annotations
 
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import numpy as np
 import polars as pl
 
 from .colors import star_rgb
+from .geometry import proper_motion_rate, radec_to_unit
+
+# Proper motion is applied per epoch rounded to this (~3.7 days: < 0.1" even
+# for Barnard's star), so scrubbing through one night reuses the same positions.
+PM_EPOCH_STEP_YR = 0.01
 
 
 @dataclass
@@ -29,10 +34,31 @@ class Catalog:
     name: np.ndarray        # display name or "" (object array)
     constellation: np.ndarray
     source_id: np.ndarray
+    unit: np.ndarray = field(init=False, repr=False)     # (N, 3) float32, J2016.0
+    unit_pm: np.ndarray = field(init=False, repr=False)  # (N, 3) float32, per year
+    _epoch: tuple = field(init=False, repr=False, default=(None, None))
+
+    def __post_init__(self):
+        self.unit = radec_to_unit(self.ra, self.dec).astype(np.float32)
+        self.unit_pm = proper_motion_rate(self.ra, self.dec, self.pmra,
+                                          self.pmdec).astype(np.float32)
 
     def __len__(self) -> int:
         return len(self.ra)
 
+    def unit_at(self, dt_years: float) -> np.ndarray:
+        """Unit vectors at J2016.0 + dt_years (linear proper motion), cached for
+        the last epoch used."""
+        step = round(dt_years / PM_EPOCH_STEP_YR)
+        if step == 0:
+            return self.unit
+        epoch = self._epoch  # one read: another session thread may swap it
+        if epoch[0] != step:
+            v = self.unit + self.unit_pm * np.float32(step * PM_EPOCH_STEP_YR)
+            v /= np.linalg.norm(v, axis=1, keepdims=True)
+            epoch = self._epoch = (step, v)
+        return epoch[1]
+
 
 def _clean(col: pl.Expr) -> pl.Expr:
     return col.cast(pl.Float64, strict=False)
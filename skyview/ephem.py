@@ -12,6 +12,7 @@ from datetime import datetime
 import numpy as np
 import astropy.units as u
 from astropy.coordinates import AltAz, EarthLocation, get_body, solar_system_ephemeris
+from astropy.coordinates.erfa_astrom import ErfaAstromInterpolator, erfa_astrom
 from astropy.time import Time
 from astropy.utils import iers
 
@@ -21,6 +22,10 @@ iers.conf.auto_download = False
 iers.conf.auto_max_age = None
 solar_system_ephemeris.set("builtin")
 
+# Batched transforms interpolate the Earth-orientation terms over this step
+# instead of evaluating them per instant (~0.1" error, ~2x faster for a night).
+ASTROM_STEP = 10 * u.min
+
 
 def warm_up() -> None:
     """Trigger astropy's one-time ERFA/ephemeris init (call behind a spinner)."""
@@ -50,19 +55,33 @@ class Body:
     info: str = ""
 
 
-def _astropy_time(when_utc: datetime) -> Time:
-    return Time(when_utc.replace(tzinfo=None), format="datetime", scale="utc")
+def _astropy_time(when_utc) -> Time:
+    """Time for a datetime, or a Time array for a sequence of them."""
+    if isinstance(when_utc, datetime):
+        return Time(when_utc.replace(tzinfo=None), format="datetime", scale="utc")
+    return Time([w.replace(tzinfo=None) for w in when_utc], format="datetime", scale="utc")
 
 
 def local_sidereal_time(when_utc: datetime, lon_deg: float) -> float:
     """Apparent local sidereal time in hours (0-24)."""
-    t = _astropy_time(when_utc)
-    lst = t.sidereal_time("apparent", longitude=lon_deg * u.deg)
-    return float(lst.hour)
+    return float(local_sidereal_times([when_utc], lon_deg)[0])
+
+
+def local_sidereal_times(times_utc, lon_deg: float) -> np.ndarray:
+    """Apparent local sidereal time in hours (0-24) for each of `times_utc`,
+    evaluated as one astropy Time array."""
+    t = _astropy_time(times_utc)
+    return np.asarray(t.sidereal_time("apparent", longitude=lon_deg * u.deg).hour, dtype=float)
 
 
 def bodies_altaz(when_utc: datetime, lat: float, lon: float) -> list[Body]:
-    t = _astropy_time(when_utc)
+    return bodies_altaz_many([when_utc], lat, lon)[0]
+
+
+def bodies_altaz_many(times_utc, lat: float, lon: float) -> list[list[Body]]:
+    """bodies_altaz for each of `times_utc`: every body's ephemeris and Alt/Az
+    transform runs once over the whole time array."""
+    t = _astropy_time(times_utc)
     loc = EarthLocation(lat=lat * u.deg, lon=lon * u.deg, height=0 * u.m)
     frame = AltAz(obstime=t, location=loc)
 
@@ -72,16 +91,16 @@ def bodies_altaz(when_utc: datetime, lat: float, lon: float) -> list[Body]:
     elong = sun.separation(moon).radian
     illum = (1.0 - np.cos(elong)) / 2.0
 
-    out: list[Body] = []
+    out: list[list[Body]] = [[] for _ in range(len(t))]
     for key, (rgb, size, label) in _BODIES.items():
         coord = sun if key == "sun" else moon if key == "moon" else get_body(key, t, loc)
-        aa = coord.transform_to(frame)
-        alt = float(aa.alt.deg)
-        az = float(aa.az.deg)
-        info = label
-        if key == "moon":
-            info = f"{label} — {illum * 100:.0f}% illuminated"
-        out.append(Body(label, alt, az, rgb, size, up=alt > -2.0, info=info))
+        with erfa_astrom.set(ErfaAstromInterpolator(ASTROM_STEP)):
+            aa = coord.transform_to(frame)
+        for i, (alt, az) in enumerate(zip(aa.alt.deg.tolist(), aa.az.deg.tolist())):
+            info = label
+            if key == "moon":
+                info = f"{label} — {illum[i] * 100:.0f}% illuminated"
+            out[i].append(Body(label, alt, az, rgb, size, up=alt > -2.0, info=info))
     return out
 
 
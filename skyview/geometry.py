@@ -1,8 +1,9 @@
 """Horizontal coordinates and the planetarium dome projection.
 
-We convert equatorial (RA/Dec) to horizontal (altitude/azimuth) with fast
-vectorised numpy given the apparent local sidereal time, then project the sky
-hemisphere onto a unit disc as seen looking straight up.
+We convert equatorial (RA/Dec) to horizontal (altitude/azimuth) given the
+apparent local sidereal time: stars are kept as unit vectors, and one 3x3
+rotation per (latitude, LST) takes them all to north/east/up at once.  Then we
+project the sky hemisphere onto a unit disc as seen looking straight up.
 """
 from __future__ import annotations
 
@@ -14,6 +15,58 @@ DEG = np.pi / 180.0
 # --------------------------------------------------------------------------- #
 # Equatorial -> Horizontal
 # --------------------------------------------------------------------------- #
+def radec_to_unit(ra_deg, dec_deg) -> np.ndarray:
+    """RA/Dec (deg) -> (N, 3) equatorial unit vectors (x to RA 0, z to the pole)."""
+    ra = np.asarray(ra_deg, dtype=float) * DEG
+    dec = np.asarray(dec_deg, dtype=float) * DEG
+    cosd = np.cos(dec)
+    return np.stack([cosd * np.cos(ra), cosd * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def proper_motion_rate(ra_deg, dec_deg, pmra_masyr, pmdec_masyr) -> np.ndarray:
+    """(N, 3) rate of change of the unit vectors, per year.  pmra is mu_alpha*
+    (already x cos dec); missing proper motions count as zero."""
+    ra = np.asarray(ra_deg, dtype=float) * DEG
+    dec = np.asarray(dec_deg, dtype=float) * DEG
+    mas = DEG / 3.6e6
+    pa = np.nan_to_num(np.asarray(pmra_masyr, dtype=float)) * mas
+    pd = np.nan_to_num(np.asarray(pmdec_masyr, dtype=float)) * mas
+    sina, cosa, sind = np.sin(ra), np.cos(ra), np.sin(dec)
+    # pa along the east unit vector, pd along the north one
+    return np.stack([-pa * sina - pd * sind * cosa,
+                     pa * cosa - pd * sind * sina,
+                     pd * np.cos(dec)], axis=-1)
+
+
+def horizon_matrix(lat_deg: float, lst_hours) -> np.ndarray:
+    """3x3 rotation taking equatorial unit vectors to (north, east, up) for an
+    observer at `lat_deg` with local sidereal time `lst_hours`; (T, 3, 3) for
+    an array of T sidereal times."""
+    lat, lst = lat_deg * DEG, np.asarray(lst_hours, dtype=float) * 15.0 * DEG
+    sl, cl, ss, cs = np.sin(lat), np.cos(lat), np.sin(lst), np.cos(lst)
+    zero, one = np.zeros_like(lst), np.ones_like(lst)
+    # (cos h cos d, -sin h cos d, sin d) for hour angle h = lst - ra ...
+    hour = np.stack([np.stack([cs, ss, zero], -1), np.stack([-ss, cs, zero], -1),
+                     np.stack([zero, zero, one], -1)], -2)
+    # ... tilted so the pole sits at altitude `lat` due north
+    tilt = np.array([[-sl, 0.0, cl], [0.0, 1.0, 0.0], [cl, 0.0, sl]])
+    return tilt @ hour
+
+
+def unit_to_altaz(unit: np.ndarray, matrix: np.ndarray, refraction: bool = True):
+    """(N, 3) equatorial unit vectors -> (altitude_deg, azimuth_deg), rotated by
+    `matrix` (see horizon_matrix) as one matmul in the vectors' dtype.  A stack
+    of T matrices gives (T, N) arrays."""
+    h = matrix.astype(unit.dtype, copy=False) @ unit.T
+    n, e, up = np.moveaxis(h, -2 if unit.ndim > 1 else -1, 0)
+    alt = np.arctan2(up, np.hypot(n, e)) / DEG       # stable at the zenith, unlike arcsin
+    az = np.arctan2(e, n) / DEG
+    az = np.where(az < 0.0, az + 360.0, az)
+    if refraction:
+        alt = apply_refraction(alt)
+    return alt, az
+
+
 def radec_to_altaz(ra_deg, dec_deg, lat_deg: float, lst_hours: float,
                    refraction: bool = True):
     """RA/Dec (deg) -> (altitude_deg, azimuth_deg) for one observer/time.
@@ -22,51 +75,20 @@ def radec_to_altaz(ra_deg, dec_deg, lat_deg: float, lst_hours: float,
     Azimuth is measured from North (0) through East (90), as is conventional.
     A simple Bennett refraction term lifts objects near the horizon.
     """
-    ra = np.asarray(ra_deg, dtype=float) * DEG
-    dec = np.asarray(dec_deg, dtype=float) * DEG
-    lat = lat_deg * DEG
-    lst = (lst_hours * 15.0) * DEG  # hours -> deg -> rad
-
-    ha = lst - ra  # hour angle
-
-    sin_alt = np.sin(dec) * np.sin(lat) + np.cos(dec) * np.cos(lat) * np.cos(ha)
-    sin_alt = np.clip(sin_alt, -1.0, 1.0)
-    alt = np.arcsin(sin_alt)
-
-    cos_az = (np.sin(dec) - np.sin(alt) * np.sin(lat)) / (np.cos(alt) * np.cos(lat) + 1e-12)
-    cos_az = np.clip(cos_az, -1.0, 1.0)
-    az = np.arccos(cos_az)
-    az = np.where(np.sin(ha) > 0.0, 2.0 * np.pi - az, az)
-
-    alt_deg = alt / DEG
-    az_deg = az / DEG
-
-    if refraction:
-        alt_deg = apply_refraction(alt_deg)
-    return alt_deg, az_deg
+    return unit_to_altaz(radec_to_unit(ra_deg, dec_deg), horizon_matrix(lat_deg, lst_hours),
+                         refraction)
 
 
 def apply_refraction(alt_deg):
-    """Bennett (1982) atmospheric refraction, arcmin -> deg, applied above ~-2 deg."""
-    alt = np.asarray(alt_deg, dtype=float)
+    """Bennett (1982) atmospheric refraction, arcmin -> deg, applied above ~-2 deg.
+    float32 input stays float32."""
+    alt = np.asarray(alt_deg, dtype=np.result_type(alt_deg, np.float32))
     a = np.clip(alt, -2.0, 90.0)
     r_arcmin = 1.0 / np.tan((a + 7.31 / (a + 4.4)) * DEG)
     r_deg = np.where(alt > -2.0, r_arcmin / 60.0, 0.0)
     return alt + r_deg
 
 
-def apply_proper_motion(ra_deg, dec_deg, pmra_masyr, pmdec_masyr, dt_years: float):
-    """Linear proper-motion update. pmra is mu_alpha* (already x cos dec)."""
-    if abs(dt_years) < 1e-6:
-        return np.asarray(ra_deg, dtype=float), np.asarray(dec_deg, dtype=float)
-    dec = np.asarray(dec_deg, dtype=float)
-    cosd = np.cos(dec * DEG)
-    cosd = np.where(np.abs(cosd) < 1e-6, 1e-6, cosd)
-    ra_new = np.asarray(ra_deg, dtype=float) + (np.asarray(pmra_masyr, dtype=float) / 3.6e6) * dt_years / cosd
-    dec_new = dec + (np.asarray(pmdec_masyr, dtype=float) / 3.6e6) * dt_years
-    return ra_new, dec_new
-
-
 # --------------------------------------------------------------------------- #
 # Dome projection: hemisphere -> unit disc (looking up; N top, E left)
 # --------------------------------------------------------------------------- #
@@ -9,8 +9,9 @@ import plotly.graph_objects as go
 
 from .catalog import Catalog
 from .colors import rgba_strings
-from .ephem import Body, bodies_altaz, local_sidereal_time, twilight_state, Twilight
-from .geometry import altaz_to_xy, apply_proper_motion, radec_to_altaz
+from .ephem import (Body, bodies_altaz, bodies_altaz_many, local_sidereal_time,
+                    local_sidereal_times, twilight_state, Twilight)
+from .geometry import altaz_to_xy, horizon_matrix, radec_to_altaz, unit_to_altaz
 
 
 # --------------------------------------------------------------------------- #
@@ -33,9 +34,11 @@ class Scene:
 
 def compute_scene(cat: Catalog, when_utc: datetime, lat: float, lon: float,
                   dt_years: float, mag_limit: float) -> Scene:
-    ra, dec = apply_proper_motion(cat.ra, cat.dec, cat.pmra, cat.pmdec, dt_years)
+    # One rotation for the whole catalogue: float32 unit vectors (proper motion
+    # applied once per epoch, see Catalog.unit_at) -> north / east / up.
     lst = local_sidereal_time(when_utc, lon)
-    star_alt, star_az = radec_to_altaz(ra, dec, lat, lst, refraction=True)
+    star_alt, star_az = unit_to_altaz(cat.unit_at(dt_years), horizon_matrix(lat, lst),
+                                      refraction=True)
 
     bodies = bodies_altaz(when_utc, lat, lon)
     sun_alt = next((b.alt for b in bodies if b.name == "Sun"), -90.0)
@@ -46,6 +49,55 @@ def compute_scene(cat: Catalog, when_utc: datetime, lat: float, lon: float,
                  bodies, sun_alt, twi, int(visible.sum()))
 
 
+@dataclass
+class Scenes:
+    """compute_scene for T instants at one place, computed in one pass.
+
+    Only the stars bright enough for `mag_limit` (`index` into the catalogue)
+    are transformed; frame(i) is the i-th instant as a Scene, with the other
+    stars' alt/az left NaN (never visible).
+    """
+    when_utc: list[datetime]
+    lat: float
+    lon: float
+    lst: np.ndarray         # (T,) hours
+    index: np.ndarray       # (K,) catalogue rows
+    star_alt: np.ndarray    # (T, K) deg
+    star_az: np.ndarray     # (T, K) deg
+    bodies: list[list[Body]]
+    sun_alt: np.ndarray     # (T,)
+    n_stars: int            # catalogue size
+
+    def __len__(self) -> int:
+        return len(self.when_utc)
+
+    def frame(self, i: int) -> Scene:
+        alt = np.full(self.n_stars, np.nan, dtype=self.star_alt.dtype)
+        az = np.full(self.n_stars, np.nan, dtype=self.star_az.dtype)
+        alt[self.index], az[self.index] = self.star_alt[i], self.star_az[i]
+        visible = alt > 0.0
+        sun_alt = float(self.sun_alt[i])
+        return Scene(self.when_utc[i], self.lat, self.lon, float(self.lst[i]), alt, az,
+                     visible, self.bodies[i], sun_alt, twilight_state(sun_alt),
+                     int(visible.sum()))
+
+
+def compute_scenes(cat: Catalog, times_utc: list[datetime], lat: float, lon: float,
+                   dt_years: float, mag_limit: float) -> Scenes:
+    """Scenes for all of `times_utc` (e.g. every frame of a time-lapse): sidereal
+    times and body ephemerides are evaluated as arrays, and the stars go through
+    one stacked (T, 3, 3) rotation.  Proper motion uses the single `dt_years`."""
+    lst = local_sidereal_times(times_utc, lon)
+    index = np.flatnonzero(cat.mag <= mag_limit)
+    star_alt, star_az = unit_to_altaz(cat.unit_at(dt_years)[index], horizon_matrix(lat, lst),
+                                      refraction=True)
+
+    bodies = bodies_altaz_many(times_utc, lat, lon)
+    sun_alt = np.array([next((b.alt for b in bs if b.name == "Sun"), -90.0) for bs in bodies])
+    return Scenes(list(times_utc), lat, lon, lst, index, star_alt, star_az, bodies,
+                  sun_alt, len(cat))
+
+
 # --------------------------------------------------------------------------- #
 # Colour helpers
 # --------------------------------------------------------------------------- #
@@ -13,8 +13,22 @@ function hsl(h, s, l) {
 }
 const clusterColor = (id) => (id < 0 ? [0.32, 0.35, 0.45] : hsl((id * 137.5) % 360, 0.65, 0.62))
 
+// Every page of one cluster's members (/clusters/{id}/members, cursor-paged).
+async function fetchMembers(id) {
+  const stars = []
+  let cursor = null
+  do {
+    const params = { limit: 20000, ...(cursor ? { cursor } : {}) }
+    const { data } = await axios.get(`/clusters/${id}/members`, { params })
+    stars.push(...data.stars)
+    cursor = data.next_cursor
+  } while (cursor)
+  return stars
+}
+
 export default function Families() {
-  const [data, setData] = useState({ clusters: [], stars: [] })
+  const [clusters, setClusters] = useState([])
+  const [members, setMembers] = useState({})   // cluster id -> member stars, once fetched
   const [loading, setLoading] = useState(true)
   const [focus, setFocus] = useState(null)
   const [active, setActive] = useState(null)
@@ -22,13 +36,16 @@ export default function Families() {
   useEffect(() => {
     setLoading(true)
     axios.get('/clusters')
-      .then((r) => setData(r.data))
-      .catch(() => setData({ clusters: [], stars: [] }))
+      .then((r) => setClusters(r.data.clusters))
+      .catch(() => setClusters([]))
       .finally(() => setLoading(false))
   }, [])
 
+  // Members are fetched per cluster on demand; until then a group is drawn as
+  // one point at its centroid, sized by membership.
   const { positions, colors, sizes } = useMemo(() => {
-    const s = data.stars
+    const s = clusters.flatMap((c) => members[c.id]
+      || [{ x: c.x, y: c.y, z: c.z, mag: 12 - 2 * Math.log10(c.n), cid: c.id }])
     const n = s.length
     const positions = new Float32Array(n * 3)
     const colors = new Float32Array(n * 3)
@@ -42,12 +59,18 @@ export default function Families() {
       sizes[i] = (2.5 + Math.max(0, 12 - st.mag) * 0.5) * (dim ? 0.6 : 1)
     })
     return { positions, colors, sizes }
-  }, [data, active])
+  }, [clusters, members, active])
 
   const pick = (c) => {
     setActive(c.id)
     setFocus({ x: c.x, y: c.y, z: c.z })
+    if (!members[c.id]) {
+      fetchMembers(c.id)
+        .then((stars) => setMembers((m) => ({ ...m, [c.id]: stars })))
+        .catch(() => {})
+    }
   }
+  const totalMembers = clusters.reduce((sum, c) => sum + c.n, 0)
 
   return (
     <>
@@ -64,10 +87,10 @@ export default function Families() {
           (position + velocity) within the solar neighbourhood. Click a group to fly to it.
         </div>
         <div className="row" style={{ marginTop: 10 }}>
-          <span className="muted">Groups</span><span>{data.clusters.length}</span>
+          <span className="muted">Groups</span><span>{clusters.length}</span>
         </div>
         <div className="row"><span className="muted">Member stars</span>
-          <span>{data.stars.length.toLocaleString()}</span></div>
+          <span>{totalMembers.toLocaleString()}</span></div>
         {active != null && (
           <button style={{ marginTop: 10 }} onClick={() => { setActive(null); setFocus({ x: 0, y: 0, z: 0 }) }}>
             ← Show all groups
@@ -77,7 +100,7 @@ export default function Families() {
 
       <div className="panel card clist">
         <h3 style={{ margin: '2px 0 8px' }}>Catalogue</h3>
-        {data.clusters.map((c) => (
+        {clusters.map((c) => (
           <div className="item" key={c.id} onClick={() => pick(c)}
                style={{ background: active === c.id ? 'rgba(122,162,255,0.14)' : undefined }}>
             <span className="swatch" style={{ background: `rgb(${clusterColor(c.id).map((v) => Math.round(v * 255)).join(',')})` }} />
@@ -85,7 +108,7 @@ export default function Families() {
             <span className="muted">{c.n}★ · {Math.round(c.dist)} ly</span>
           </div>
         ))}
-        {!data.clusters.length && !loading && <div className="muted" style={{ fontSize: '0.8rem' }}>No clusters yet — run bq_jobs/clustering.py.</div>}
+        {!clusters.length && !loading && <div className="muted" style={{ fontSize: '0.8rem' }}>No clusters yet — run bq_jobs/clustering.py.</div>}
       </div>
     </>
   )
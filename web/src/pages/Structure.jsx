@@ -11,6 +11,12 @@ function heat(t) {
   const i = Math.floor(x), f = x - i
   return s[i].map((c, k) => (c + (s[i + 1][k] - c) * f) / 255)
 }
+// Finest density level (lod 0): HEALPix level 2 sectors x 50 ly shells.  Coarser
+// levels pool 4 sectors per level step and shell_ly / 50 shells per voxel.
+const BASE_HP_LEVEL = 2, BASE_SHELL_LY = 50
+function voxelsPerBase(hpLevel, shellLy) {
+  return 4 ** (BASE_HP_LEVEL - hpLevel) * (shellLy / BASE_SHELL_LY)
+}
 // approximate true star colour from BP-RP
 function bpColor(bp) {
   const t = Math.min(1, Math.max(0, (bp + 0.4) / 3.2))
@@ -23,24 +29,30 @@ export default function Structure() {
   const [minN, setMinN] = useState(0)
   const [mode, setMode] = useState('density')
   const [voxels, setVoxels] = useState([])
+  const [shell, setShell] = useState(null)
+  const [hpLevel, setHpLevel] = useState(BASE_HP_LEVEL)
   const [hr, setHr] = useState([])
   const [loading, setLoading] = useState(true)
 
-  useEffect(() => { axios.get('/hr').then((r) => setHr(r.data.bins)).catch(() => {}) }, [])
-
   useEffect(() => {
     const t = setTimeout(() => {
+      const params = { min_dist: minD, max_dist: maxD }
       setLoading(true)
-      axios.post('/density', { min_dist: minD, max_dist: maxD })
-        .then((r) => setVoxels(r.data.voxels))
+      axios.get('/density', { params })
+        .then((r) => {
+          setVoxels(r.data.voxels); setShell(r.data.shell_ly); setHpLevel(r.data.healpix_level)
+        })
         .catch(() => setVoxels([]))
         .finally(() => setLoading(false))
+      axios.get('/hr', { params }).then((r) => setHr(r.data.bins)).catch(() => {})
     }, 250)
     return () => clearTimeout(t)
   }, [minD, maxD])
 
   const { positions, colors, sizes, totalStars, filteredCount } = useMemo(() => {
-    const filteredVoxels = voxels.filter(v => v.n >= minN)
+    // minN is per finest voxel: scale it to the volume the served level pools
+    const threshold = minN * voxelsPerBase(hpLevel, shell ?? BASE_SHELL_LY)
+    const filteredVoxels = voxels.filter(v => v.n >= threshold)
     const n = filteredVoxels.length
     const positions = new Float32Array(n * 3)
     const colors = new Float32Array(n * 3)
@@ -55,7 +67,7 @@ export default function Structure() {
       total += v.n
     })
     return { positions, colors, sizes, totalStars: total, filteredCount: n }
-  }, [voxels, mode, minN])
+  }, [voxels, mode, minN, hpLevel, shell])
 
   const cam = Math.max(400, maxD * 0.9)
 
@@ -78,7 +90,7 @@ export default function Structure() {
         <label>Max distance: {maxD} ly</label>
         <input type="range" min={200} max={17000} step={100} value={maxD}
                onChange={(e) => setMaxD(Math.max(+e.target.value, minD + 100))} />
-        <label>Min stars/cluster: {minN.toLocaleString()}</label>
+        <label>Min stars per {BASE_SHELL_LY} ly voxel: {minN.toLocaleString()}</label>
         <input type="range" min={0} max={30000} step={50} value={minN}
                onChange={(e) => setMinN(+e.target.value)} />
         <label>Colour by</label>
@@ -96,6 +108,7 @@ export default function Structure() {
           <span>{filteredCount.toLocaleString()} <span className="muted" style={{fontSize: '0.8em'}}>({voxels.length.toLocaleString()})</span></span>
         </div>
         <div className="row"><span className="muted">Stars</span><span>{totalStars.toLocaleString()}</span></div>
+        {shell && <div className="row"><span className="muted">Shell</span><span>{shell} ly</span></div>}
         <div className="row muted" style={{ marginTop: 6, fontSize: '0.72rem' }}>teal dot = Sun</div>
       </div>
 
@@ -11,10 +11,17 @@ export default defineConfig({
   server: {
     proxy: {
       '/stars': api,
+      '/star/': api,
       '/density': api,
       '/hr': api,
       '/clusters': api,
+      '/tiles': api,
+      '/cone': api,
+      '/neighbors': api,
+      '/within': api,
       '/health': api,
+      '/metrics': api,
+      '/stats': api,
     },
   },
 })